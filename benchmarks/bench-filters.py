@@ -0,0 +1,67 @@
+#!/opt/local/bin/python3.7
+
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# This program compares the compiled ID filter of board.py with a plain
+# fnmatch loop over all component and trace IDs of a board.
+#
+
+import fnmatch
+import os
+import timeit
+from re import split
+from sys import argv, exit, path, version_info
+
+path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import board
+
+FILTERS = ["U160", "U1??", "U*", "*", "U160,R5,X*", "A1?,SYNC*,PRAS*", "C1,C2,C3,C4,C5,C6,C7,C8,C9,C10"]
+
+
+def fnmatch_keys(keys, id_filter):
+    filters = split(",", id_filter)
+    return {key for key in keys if any([fnmatch.fnmatch(key, flt) for flt in filters])}
+
+
+def bench(name, keys, number):
+    print("{} ({} keys, {} runs):".format(name, len(keys), number))
+    print("  {:<34} {:>13} {:>13} {:>8}".format("filter", "fnmatch [us]", "compiled [us]", "matches"))
+    for flt in FILTERS:
+        if fnmatch_keys(keys, flt) != board.match_keys(keys, flt):
+            print("  {:<34} results differ!".format(flt))
+            continue
+        t_old = timeit.timeit(lambda: fnmatch_keys(keys, flt), number=number) / number * 1e6
+        t_new = timeit.timeit(lambda: board.match_keys(keys, flt), number=number) / number * 1e6
+        print("  {:<34} {:>13.1f} {:>13.1f} {:>8}".format(flt, t_old, t_new, len(board.match_keys(keys, flt))))
+    print()
+
+
+def main(main_argv):
+    json_file = main_argv[0] if len(main_argv) > 0 else "data/a3-board.json"
+    b = board.load_json(json_file, True)
+    if b is None:
+        exit(1)
+    print()
+    bench("Components", b.components, 200)
+    bench("Traces", b.traces, 200)
+
+
+if __name__ == "__main__":
+    assert version_info >= (3, 0)
+    main(argv[1:])
@@ -0,0 +1,91 @@
+#!/opt/local/bin/python3.7
+
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# This program measures the time of exporting components or traces of a board
+# to a PDF file, one item per page.
+#
+
+
+import contextlib
+import io
+import os
+import time
+from sys import argv, exit, path, version_info
+
+path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import board
+
+
+def new_figure_per_page(b, gca, display):
+    board.pyplot.close(gca[3])
+    return board.init_gca(b, dpi=gca[5].dpi, zoom=gca[5].zoom)
+
+
+def export(b, id_filter, traces, pdf_file, dpi, zoom):
+    board.import_graphics()
+    pdf = board.PdfPages(pdf_file)
+    board.text_path.cache_clear()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        gca = board.init_gca(b, dpi=dpi, zoom=zoom)
+        if traces:
+            board.print_traces(b, id_filter, False, False, False, pdf, gca)
+        else:
+            board.print_components(b, id_filter, False, False, True, False, pdf, gca)
+    pdf.close()
+    t = time.perf_counter() - start
+    board.compact_pdf_file(pdf_file)
+    return t
+
+
+def main(main_argv):
+    json_file = main_argv[0] if len(main_argv) > 0 else "data/a3-board.json"
+    component_filter = main_argv[1].upper() if len(main_argv) > 1 else "*"
+    trace_filter = main_argv[2].upper() if len(main_argv) > 2 else "*"
+    pdf_file = "bench-render.pdf"
+    b = board.load_json(json_file, True)
+    if b is None:
+        exit(1)
+    b.image
+    reuse = board.next_gca
+    print()
+    print("{:<36} {:>6} {:>9} {:>10} {:>11} {:>9}".format("export", "pages", "time [s]", "[ms]/page", "label hits",
+                                                        "PDF [MB]"))
+    for traces in (False, True):
+        id_filter = trace_filter if traces else component_filter
+        pages = len(board.match_keys(b.traces if traces else b.components, id_filter))
+        for name, next_gca, dpi, zoom in (("new figure per page", new_figure_per_page, None, False),
+                                          ("reused figure", reuse, None, False),
+                                          ("reused figure, pyramid", reuse, board.PDF_DPI, False),
+                                          ("reused figure, pyramid, zoom", reuse, board.PDF_DPI, True)):
+            board.next_gca = next_gca
+            t = export(b, id_filter, traces, pdf_file, dpi, zoom)
+            info = board.text_path.cache_info()
+            print("{:<36} {:>6} {:>9.2f} {:>10.1f} {:>10.1f}% {:>9.2f}".format(
+                ("-t " if traces else "-c ") + name, pages, t, t / max(pages, 1) * 1e3,
+                100 * info.hits / max(info.hits + info.misses, 1), os.path.getsize(pdf_file) / 1e6))
+    board.next_gca = reuse
+    os.remove(pdf_file)
+    print()
+
+
+if __name__ == "__main__":
+    assert version_info >= (3, 0)
+    main(argv[1:])
@@ -0,0 +1,84 @@
+#!/opt/local/bin/python3.7
+
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# This program compares the spatial index of component boxes with a plain
+# scan over all boxes for point, region and nearest neighbor queries.
+#
+
+import os
+import random
+import timeit
+from sys import argv, exit, path, version_info
+
+path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import board
+import board_spatial
+
+
+def scan_at(boxes, x, y):
+    return {cid for cid, b in boxes.items() if b[0] <= x <= b[2] and b[1] <= y <= b[3]}
+
+
+def scan_region(boxes, x0, y0, x1, y1):
+    return {cid for cid, b in boxes.items() if b[0] <= x1 and b[2] >= x0 and b[1] <= y1 and b[3] >= y0}
+
+
+def scan_nearest(boxes, x, y, k, exclude):
+    return sorted([(board_spatial.box_distance(b, x, y), cid) for cid, b in boxes.items() if cid not in exclude])[:k]
+
+
+def bench(name, scan, indexed, queries, number):
+    for q in queries:
+        if scan(*q) != indexed(*q):
+            print("  {:<20} results differ for {}!".format(name, q))
+            return
+    t_scan = timeit.timeit(lambda: [scan(*q) for q in queries], number=number) / number / len(queries) * 1e6
+    t_index = timeit.timeit(lambda: [indexed(*q) for q in queries], number=number) / number / len(queries) * 1e6
+    print("  {:<20} {:>10.1f} {:>10.1f}".format(name, t_scan, t_index))
+
+
+def main(main_argv):
+    json_file = main_argv[0] if len(main_argv) > 0 else "data/a3-board.json"
+    b = board.load_json(json_file, True)
+    if b is None:
+        exit(1)
+    t_build = timeit.timeit(lambda: board_spatial.SpatialIndex(b.components), number=20) / 20 * 1e3
+    index = b.spatial_index
+    boxes = {cid: board_spatial.normalize_box(c["box"]) for cid, c in b.components.items() if "box" in c}
+    x1 = max([i[2] for i in boxes.values()])
+    y1 = max([i[3] for i in boxes.values()])
+    rnd = random.Random(1)
+    points = [(rnd.uniform(0, x1), rnd.uniform(0, y1)) for __ in range(200)]
+    regions = [(x, y, x + rnd.uniform(0, x1 / 4), y + rnd.uniform(0, y1 / 4)) for x, y in points]
+    nearest = [(board.component_center(b.components[cid]) + (5, (cid,))) for cid in sorted(boxes)[:200]]
+    print()
+    print("{} boxes, index built in {:.2f} ms, {} cells of {:.0f} pixels".format(len(boxes), t_build, len(index.cells),
+                                                                                   index.cell))
+    print("  {:<20} {:>10} {:>10}".format("query", "scan [us]", "index [us]"))
+    bench("point", lambda x, y: scan_at(boxes, x, y), lambda x, y: set(index.at(x, y)), points, 20)
+    bench("region", lambda *r: scan_region(boxes, *r), lambda *r: set(index.region(*r)), regions, 20)
+    bench("nearest 5", lambda x, y, k, e: [d for d, __ in scan_nearest(boxes, x, y, k, e)],
+          lambda x, y, k, e: [d for __, d in index.nearest(x, y, k, e)], nearest, 20)
+    print()
+
+
+if __name__ == "__main__":
+    assert version_info >= (3, 0)
+    main(argv[1:])
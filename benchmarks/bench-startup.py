@@ -0,0 +1,103 @@
+#!/opt/local/bin/python3.7
+
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# This program measures the start-up time of board.py for scripted text-only
+# lookups and checks which of the heavy modules got imported on the way.
+#
+
+
+import importlib.util
+import json
+import os
+import subprocess
+import tempfile
+import time
+from sys import argv, executable, exit, version_info
+
+BOARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "board.py")
+SYNTHETIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic-board.py")
+HEAVY_MODULES = ["matplotlib", "PIL", "numpy"]
+
+CHECK_IMPORTS = """
+import sys
+sys.argv = ["board.py"] + sys.argv[1:]
+sys.path.insert(0, {!r})
+import board
+board.prog_name = "board.py"
+board.main(sys.argv[1:])
+print("MODULES:" + ",".join([m for m in {!r} if m in sys.modules]))
+"""
+
+
+def run(args, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([executable, BOARD] + args, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+
+def loaded_modules(args):
+    code = CHECK_IMPORTS.format(os.path.dirname(BOARD), HEAVY_MODULES)
+    out = subprocess.run([executable, "-c", code] + args, stdout=subprocess.PIPE, check=True, universal_newlines=True)
+    return [line[8:] for line in out.stdout.split("\n") if line.startswith("MODULES:")][-1]
+
+
+def synthetic_board(components, json_file):
+    spec = importlib.util.spec_from_file_location("synthetic_board", SYNTHETIC)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    with open(json_file, "w") as f:
+        json.dump(module.synthetic_board(components), f)
+
+
+def measure(json_file, runs, name):
+    print()
+    print("{:<40} {:>9} {:>9}   {}".format("command", "min [ms]", "avg [ms]", "heavy modules loaded"))
+    for args in (["-cU1"], ["-cU1", "--cache"], ["-c*", "-d"], ["-t*", "-d", "--cache"]):
+        if "--cache" in args:
+            run(["-j", json_file] + args, 1)
+        t_min, t_avg = run(["-j", json_file] + args, runs)
+        modules = loaded_modules(["-j", json_file] + args)
+        print("{:<40} {:>9.1f} {:>9.1f}   {}".format(" ".join(["-j", name] + args), t_min * 1e3, t_avg * 1e3,
+                                                     "-" if modules == "" else modules))
+    print()
+
+
+def main(main_argv):
+    json_file = main_argv[0] if len(main_argv) > 0 else "data/a3-board.json"
+    runs = int(main_argv[1]) if len(main_argv) > 1 else 20
+    if json_file.isdigit():
+        # a synthetic board with the given number of components
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, "synthetic-{}.json".format(json_file))
+            synthetic_board(int(json_file), fname)
+            measure(fname, runs, "synthetic-{}.json".format(json_file))
+        return
+    if not os.path.exists(json_file):
+        print("\nCan't open file:", json_file, "\n")
+        exit(1)
+    measure(json_file, runs, json_file)
+
+
+if __name__ == "__main__":
+    assert version_info >= (3, 0)
+    main(argv[1:])
@@ -0,0 +1,205 @@
+#!/opt/local/bin/python3.7
+
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# This program runs the complete set of benchmarks on synthetic boards of
+# growing size: loading the board, component, trace, merged, spatial and graph
+# queries, PDF and image export and wire list parsing. The results are printed
+# and written to a JSON file, which can be given to a later run to compare the
+# times.
+#
+
+import contextlib
+import datetime
+import getopt
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from sys import argv, exit, path, version_info
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+path.insert(0, ROOT)
+import board
+
+RESULTS_VERSION = 1
+
+# name, board.py options, export (--pdf file or --png-dir directory)
+QUERIES = [("components all", ["-c", "*"], None),
+           ("components prefix detailed", ["-c", "U1*", "-d"], None),
+           ("components merged", ["-c", "U1??", "-m"], None),
+           ("traces all", ["-t", "*"], None),
+           ("traces prefix detailed", ["-t", "T1*", "-d"], None),
+           ("traces merged", ["-t", "SIG1?,A*", "-m"], None),
+           ("spatial region", ["--region", "0,0,2000,2000"], None),
+           ("spatial nearest", ["--nearest", "U1,10"], None),
+           ("graph path", ["--path", "U1,U7"], None),
+           ("graph hops", ["--hops", "U1,3"], None),
+           ("search substring", ["-s", "U12"], None),
+           ("search fuzzy", ["-s", "SIGI2"], None),
+           ("pdf components neighbors", ["-c", "U1?", "-n"], "--pdf"),
+           ("pdf traces", ["-t", "T10?"], "--pdf"),
+           ("png components neighbors", ["-c", "U1?", "-n"], "--png-dir"),
+           ("jpeg traces", ["-t", "T10?", "--jpeg"], "--png-dir")]
+
+
+def load_module(name, fname):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, "benchmarks", fname))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(func, repeat):
+    # returns (times of all runs, result of the last run)
+    times = []
+    result = None
+    for __ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def query(b, json_file, args, export):
+    o = board.parse_options(["-j", json_file] + args + (list(export) if export is not None else []))
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        board.run_query(b, o)
+    return out.getvalue().count("\n")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(components, repeat, pdf, tmp, record):
+    synthetic = load_module("synthetic_board", "synthetic-board.py")
+    json_file = os.path.join(tmp, "synthetic-{}.json".format(components))
+    with open(json_file, "w") as f:
+        json.dump(synthetic.synthetic_board(components), f)
+    record(components, "load json", *measure(lambda: len(board.load_json(json_file, True).components), repeat))
+    board.load_json(json_file, True, cache=True)
+    record(components, "load cache", *measure(lambda: len(board.load_json(json_file, True, True).components), repeat))
+    b = board.load_json(json_file, True)
+    for name, args, export in QUERIES:
+        if export is not None and not pdf:
+            continue
+        if export is not None:
+            export = export, os.path.join(tmp, "bench.pdf" if export == "--pdf" else "bench-images")
+        record(components, name, *measure(lambda: query(b, json_file, args, export), 1 if export else repeat))
+
+    wire_list = load_module("bench_wire_list", "bench-wire-list.py")
+    parser = wire_list.load_parser()
+    fname = os.path.join(tmp, "synthetic-{}-wire-list.txt".format(components))
+    wire_list.synthetic_wire_list(fname, components)
+
+    def parse():
+        with open(fname, "r") as f:
+            return len(parser.parse_board(f, lambda *a: None)["components"])
+    record(components, "parse wire list", *measure(parse, repeat))
+
+
+def usage():
+    print("\nUsage: bench-suite.py [options]\n")
+    print("  {:<33} {}".format("-s, --sizes n,n,...", "numbers of components of the synthetic boards (1000,10000)"))
+    print("  {:<33} {}".format("-r, --repeat n", "runs of each benchmark, the best time is compared (3)"))
+    print("  {:<33} {}".format("-o, --output file.json", "file to write the results to (bench-results.json)"))
+    print("  {:<33} {}".format("--compare file.json", "results of an earlier run to compare with"))
+    print("  {:<33} {}".format("--no-pdf", "skip the PDF and image export benchmarks"))
+    print()
+    exit(1)
+
+
+def main(main_argv):
+    try:
+        opts, __ = getopt.getopt(main_argv, "hs:r:o:", ["help", "sizes=", "repeat=", "output=", "compare=", "no-pdf"])
+    except getopt.GetoptError:
+        usage()
+    sizes = [1000, 10000]
+    repeat = 3
+    output = "bench-results.json"
+    compare = None
+    pdf = True
+    for opt, arg in opts:
+        if opt in ["-h", "--help"]:
+            usage()
+        elif opt in ["-s", "--sizes"]:
+            if not all(s.isdigit() and int(s) > 0 for s in arg.split(",")):
+                usage()
+            sizes = [int(s) for s in arg.split(",")]
+        elif opt in ["-r", "--repeat"]:
+            if not arg.isdigit() or int(arg) < 1:
+                usage()
+            repeat = int(arg)
+        elif opt in ["-o", "--output"]:
+            output = arg
+        elif opt in ["--compare"]:
+            compare = arg
+        elif opt in ["--no-pdf"]:
+            pdf = False
+
+    previous = {}
+    if compare is not None:
+        try:
+            with open(compare, "r") as f:
+                previous = {(r["components"], r["benchmark"]): r for r in json.load(f)["results"]}
+        except (IOError, ValueError, KeyError):
+            print("\nCan't open file:", compare, "\n")
+            exit(1)
+
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    results = []
+
+    def record(components, name, times, count):
+        r = {"components": components, "benchmark": name, "count": count, "first": times[0], "best": min(times),
+             "median": statistics.median(times)}
+        results.append(r)
+        old = previous.get((components, name))
+        change = "{:>+8.1f}%".format((r["best"] / old["best"] - 1) * 100) if old is not None and old["best"] > 0 \
+            else ""
+        print("{:>8} {:<28} {:>8} {:>11.2f} {:>11.2f} {}".format(components, name, count, r["first"] * 1e3,
+                                                                 r["best"] * 1e3, change), flush=True)
+
+    print()
+    print("{:>8} {:<28} {:>8} {:>11} {:>11} {}".format("size", "benchmark", "count", "first [ms]", "best [ms]",
+                                                       "vs. previous" if compare is not None else ""))
+    with tempfile.TemporaryDirectory() as tmp:
+        for components in sizes:
+            run_size(components, repeat, pdf, tmp, record)
+    print()
+
+    with open(output, "w") as f:
+        json.dump({"version": RESULTS_VERSION, "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                   "revision": git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+                   "repeat": repeat, "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    assert version_info >= (3, 0)
+    main(argv[1:])
@@ -0,0 +1,140 @@
+#!/opt/local/bin/python3.7
+
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# This program measures the time of parsing the Apple /// wire list and
+# of larger synthetic wire lists in the same format.
+#
+
+
+import importlib.util
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from sys import argv, version_info
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PARSER = os.path.join(ROOT, "original", "apple3", "a3-parse-wire-list.py")
+WIRE_LIST = os.path.join(ROOT, "original", "apple3", "a3-wire-list.txt")
+
+
+def load_parser():
+    spec = importlib.util.spec_from_file_location("a3_parse_wire_list", PARSER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_wire_list(fname, components, seed=1):
+    # chips with 14-40 pins, GND and +5V pins, named and unnamed traces of 2-12 pins and some unconnected pins;
+    # like on real boards most traces connect nearby chips (listed close to each other), a few span the board
+    rnd = random.Random(seed)
+    pin_counts = [rnd.choice((14, 16, 16, 20, 24, 40)) for __ in range(components)]
+    power = [(n // 2 - 1, n - 1) for n in pin_counts]
+    groups = [[] for __ in range((components + 49) // 50 + 1)]
+    for c in range(components):
+        for p in range(pin_counts[c]):
+            if p not in power[c]:
+                groups[-1 if rnd.random() < 0.02 else c // 50].append("U{}-{}".format(c + 1, p + 1))
+    net_of = {}
+    nets = []
+    for pins in groups:
+        rnd.shuffle(pins)
+        while len(pins) > 0:
+            size = min(len(pins), rnd.randint(1, 12))
+            net, pins = pins[:size], pins[size:]
+            name = "NOCONNECTION" if size == 1 else ("?" if rnd.random() < 0.6 else "N{}".format(len(nets)))
+            nets.append((name, net))
+            for p in net:
+                net_of[p] = len(nets) - 1
+    with open(fname, "w") as f:
+        for c in range(components):
+            cid = "U{}".format(c + 1)
+            f.write("{} {} LS{} {} {}{}\n".format(cid, rnd.randint(1, 70), rnd.randint(0, 999), pin_counts[c],
+                                                 chr(ord("A") + rnd.randint(0, 13)), rnd.randint(1, 14)))
+            for p in range(pin_counts[c]):
+                if p == power[c][0]:
+                    f.write("{} GND\n".format(p + 1))
+                elif p == power[c][1]:
+                    f.write("{} +5V\n".format(p + 1))
+                else:
+                    name, net = nets[net_of["{}-{}".format(cid, p + 1)]]
+                    f.write("{} {}{}\n".format(p + 1, name, "" if len(net) == 1 else " " + " ".join(net)))
+            f.write("\n")
+
+
+class NullWriter:
+    def write(self, s):
+        pass
+
+
+def parse(parser, fname, stream):
+    # the whole board dictionary is built, or records are streamed as JSON-Lines to nowhere
+    errors = []
+    counts = {"component": 0, "trace": 0}
+
+    def count(items):
+        for item in items:
+            counts[item[0]] += 1
+            yield item
+
+    start = time.perf_counter()
+    with open(fname, "r") as file:
+        if stream:
+            parser.write_jsonl(count(parser.parse_wire_list(file, lambda *a: errors.append(a))), NullWriter())
+        else:
+            board = parser.parse_board(file, lambda *a: errors.append(a))
+            counts = {"component": len(board["components"]), "trace": len(board["traces"])}
+    return time.perf_counter() - start, counts["component"], counts["trace"], len(errors)
+
+
+def peak_memory(parser, fname, stream):
+    tracemalloc.start()
+    parse(parser, fname, stream)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def main(main_argv):
+    sizes = [int(i) for i in main_argv] if len(main_argv) > 0 else [1000, 3000, 10000]
+    print()
+    print("{:<30} {:>8} {:>11} {:>8} {:>8} {:>9} {:>9} {:>11}".format(
+        "wire list", "lines", "components", "traces", "errors", "time [s]", "peak [MB]", "stream [MB]"))
+    parser = load_parser()
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [("a3-wire-list.txt", WIRE_LIST)]
+        for size in sizes:
+            fname = os.path.join(tmp, "synthetic-{}.txt".format(size))
+            synthetic_wire_list(fname, size)
+            files.append(("synthetic, {} components".format(size), fname))
+        for name, fname in files:
+            with open(fname, "r") as f:
+                lines = sum(1 for __ in f)
+            t, components, traces, errors = parse(parser, fname, False)
+            print("{:<30} {:>8} {:>11} {:>8} {:>8} {:>9.2f} {:>9.1f} {:>11.1f}".format(
+                name, lines, components, traces, errors, t, peak_memory(parser, fname, False),
+                peak_memory(parser, fname, True)))
+    print()
+
+if __name__ == "__main__":
+    assert version_info >= (3, 0)
+    main(argv[1:])
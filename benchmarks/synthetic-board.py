@@ -0,0 +1,124 @@
+#!/opt/local/bin/python3.7
+
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# This program generates a synthetic board JSON file of a given size, used to
+# measure how the tools scale with the number of components. The board has a mix
+# of chips, resistors, capacitors, connectors, transistors and diodes placed in
+# rows, power traces, named and T### traces, some unconnected pins and boxes
+# (some with negative width or height, like rotated parts on a real board).
+#
+
+import json
+import random
+from sys import argv, exit, version_info
+
+# type letter, share of components, pin counts, part names, component type
+KINDS = [("U", 45, (14, 16, 16, 16, 20, 24, 28, 40), ("LS00", "LS74", "LS138", "LS161", "LS244", "LS374", "S86"), ""),
+         ("R", 20, (2,), ("1K", "3.3K", "47", "10K"), "RESQW"),
+         ("C", 25, (2,), (".1U", "10U", "220P"), "CAPMON"),
+         ("J", 3, (10, 16, 26, 50), ("10PIN", "16PIN", "26PIN", "50PIN"), "MOLEX"),
+         ("Q", 3, (3,), ("3904", "3906"), "TR1"),
+         ("X", 4, (2,), ("IN4148",), "DIODE")]
+NAMED_TRACES = ["A{}".format(i) for i in range(16)] + ["D{}".format(i) for i in range(8)] + \
+               ["SYNC", "PHI0", "PHI1", "RESET*", "IRQ*", "NMI*", "R/W", "RDY", "SO", "C7M", "C14M", "SEL1M"]
+POWER_TRACES = ["GND", "+5V", "+12V", "-12V", "-5V"]
+CELL_WIDTH = 180
+CELL_HEIGHT = 120
+
+
+def net_size(rnd):
+    # most traces connect a few pins, some are long buses
+    r = rnd.random()
+    return rnd.randint(2, 3) if r < 0.6 else rnd.randint(4, 8) if r < 0.95 else rnd.randint(9, 40)
+
+
+def synthetic_board(components, seed=1):
+    rnd = random.Random(seed)
+    weights = [k[1] for k in KINDS]
+    columns = max(1, int((components * 1.6) ** 0.5))
+    counters = {}
+    board = {"components": {}, "traces": {}}
+    free_pins = []
+    power_pins = {p: [] for p in POWER_TRACES}
+    for n in range(components):
+        letter, __, pin_counts, parts, ctype = rnd.choices(KINDS, weights)[0]
+        counters[letter] = counters.get(letter, 0) + 1
+        cid = "{}{}".format(letter, counters[letter])
+        pin_count = rnd.choice(pin_counts)
+        pins = [""] * pin_count
+        if letter == "U":
+            power = {pin_count // 2 - 1: "GND", pin_count - 1: "+5V"}
+        elif letter == "C" and rnd.random() < 0.6:
+            power = {0: "+5V", 1: "GND"}
+        elif letter == "J":
+            power = {0: "GND", 1: "+5V", 2: rnd.choice(("+12V", "-12V", "-5V"))}
+        else:
+            power = {}
+        for p in range(pin_count):
+            if p in power:
+                pins[p] = power[p]
+                power_pins[power[p]].append([cid, p])
+            elif rnd.random() > 0.03:
+                free_pins.append((cid, p))
+        col, row = n % columns, n // columns
+        w = 150 if pin_count > 3 else 60
+        h = 40 + pin_count * 2 if pin_count > 3 else 25
+        box = [col * CELL_WIDTH + 10, row * CELL_HEIGHT + 10, w, h]
+        if rnd.random() < 0.1:
+            box = [box[0] + w, box[1] + h, -w, -h]
+        board["components"][cid] = {"id": cid, "part": rnd.choice(parts), "type": ctype,
+                                    "location": "{}{}".format(chr(ord("A") + row % 14), col % 14 + 1),
+                                    "pages": [row % 12 + 1], "pin_count": pin_count, "pins": pins, "box": box}
+    # traces connect mostly pins of components placed close to each other, as on a real board
+    free_pins.sort(key=lambda p: (int(p[0][1:]) // 8 + rnd.random() * 3))
+    named = 0
+    while len(free_pins) > 0:
+        size = min(len(free_pins), net_size(rnd))
+        start = rnd.randrange(max(1, min(len(free_pins), 64) - size + 1))
+        net = free_pins[start:start + size]
+        del free_pins[start:start + size]
+        if named < len(NAMED_TRACES) and rnd.random() < 0.01:
+            tid = NAMED_TRACES[named]
+            named += 1
+        elif rnd.random() < 0.3:
+            tid = "SIG{}".format(len(board["traces"]))
+        else:
+            tid = "T{:03}".format(len(board["traces"]))
+        board["traces"][tid] = [[cid, p] for cid, p in net]
+        for cid, p in net:
+            board["components"][cid]["pins"][p] = tid
+    for p in POWER_TRACES:
+        if len(power_pins[p]) > 0:
+            board["traces"][p] = power_pins[p]
+    return board
+
+
+def main(main_argv):
+    if len(main_argv) < 2 or not main_argv[0].isdigit():
+        print("\nUsage: synthetic-board.py <components> <json-file.json> [seed]\n")
+        exit(1)
+    board = synthetic_board(int(main_argv[0]), int(main_argv[2]) if len(main_argv) > 2 else 1)
+    with open(main_argv[1], "w") as f:
+        json.dump(board, f, sort_keys=True, indent=4)
+
+
+if __name__ == "__main__":
+    assert version_info >= (3, 0)
+    main(argv[1:])
@@ -25,40 +25,200 @@
 # Author: Pawel Pieczul
 #
 
+import contextlib
+import copy
+import csv
 import datetime
 import fnmatch
+import gc
 import getopt
+import io
 import math
-import numpy
 import json
+import os
+import re
+import shlex
+import tempfile
+import time
 from re import split
 from json import load
-from functools import reduce
-from sys import exit, version_info, argv
-
-from PIL import Image
-from matplotlib import pyplot
-from matplotlib.backends.backend_pdf import PdfPages
-from matplotlib.font_manager import FontProperties
-from matplotlib.patches import Rectangle, PathPatch, Polygon
-from matplotlib.text import TextPath
-from matplotlib.transforms import Affine2D
+from functools import lru_cache
+from itertools import chain
+from sys import exit, version_info, argv, modules, stderr
+
+# graphics modules are imported on first use by import_graphics(), text queries do not need them
+pyplot = None
+PdfPages = None
+FontProperties = None
+Rectangle = PathPatch = Polygon = None
+PatchCollection = LineCollection = None
+TextPath = None
+Affine2D = None
+
+COMPONENT_COLORS = {"U": "#00ff00",
+                    "L": "#ff0000",
+                    "J": "#ffff00",
+                    "Q": "#ff0000",
+                    "P": "#ff00ff",
+                    "C": "#00ffff",
+                    "R": "#ff3388",
+                    "X": "#ff0000",
+                    "Y": "#33ff88",
+                    "T": "#9955ff"}
+
+PDF_DPI = 60
+# pages stored in the render cache are drawn again when the drawing code changes and this number is increased
+RENDER_VERSION = 1
+LIBRARY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "original", "components.txt")
+# options with file and directory paths, sent by --connect as absolute paths (add every new path option here)
+# and the ones writing files, refused by the server without --allow-write
+PATH_OPTIONS = (("-j", "json_file"), ("-p", "pdf_file"), ("--png-dir", "png_dir"), ("--render-cache", "render_cache"),
+                ("--db", "db_file"), ("--library", "library"), ("--profile", "profile_file"))
+WRITE_OPTIONS = ("pdf_file", "png_dir", "render_cache", "db_file", "profile_file")
+
+
+def import_graphics():
+    global pyplot, PdfPages, FontProperties, Rectangle, PathPatch, Polygon, PatchCollection, LineCollection
+    global TextPath, Affine2D
+    if pyplot is not None:
+        return
+    from matplotlib import pyplot
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.collections import PatchCollection, LineCollection
+    from matplotlib.font_manager import FontProperties
+    from matplotlib.patches import Rectangle, PathPatch, Polygon
+    from matplotlib.text import TextPath
+    from matplotlib.transforms import Affine2D
+
+
+@contextlib.contextmanager
+def gc_paused():
+    # loading creates millions of objects without reference cycles, garbage collections on the way only cost time
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
 
 class MotherBoard:
-    def __init__(self, json_dict, black_white):
-        if "components" not in json_dict or "traces" not in json_dict:
+    @gc_paused()
+    def __init__(self, json_dict, black_white, image_loader=None, model=None):
+        if model is None and ("components" not in json_dict or "traces" not in json_dict):
             print("Json does not contain components/traces on top level.")
         else:
-            self.components = json_dict["components"]
-            self.traces = json_dict["traces"]
-            if "board_image" in json_dict:
-                img = Image.open("./pictures/" + json_dict["board_image"])
-                if black_white:
-                    img = img.convert("L")
-                self.image = numpy.flipud(numpy.asarray(img))
-            else:
-                self.image = None
+            if model is None:
+                import board_model
+                model = board_model.build_model(json_dict["components"], json_dict["traces"])
+            self.components, self.traces, self.ids = model
+            self.black_white = black_white
+            self.image_file = json_dict.get("board_image")
+            self._image = None
+            self._image_loader = image_loader
+            self._spatial_index = None
+            self._image_pyramid = None
+            self._net_graphs = {}
+            self._signal_graphs = {}
+            self._box_centers = None
+            self._search_index = None
+            self.build_indexes()
+
+    @property
+    def image(self):
+        # the board picture is decoded on first draw only
+        if self._image is None:
+            if self._image_loader is not None:
+                self._image = self._image_loader()
+            elif self.image_file is not None:
+                self._image = load_image(self.image_file, self.black_white)
+        return self._image
+
+    @property
+    def image_pyramid(self):
+        # scaled down copies of the board picture, cached on disk next to it
+        if self._image_pyramid is None and self.image_file is not None:
+            import board_pyramid
+            self._image_pyramid = board_pyramid.ImagePyramid("./pictures/" + self.image_file, self.black_white,
+                                                             lambda: self.image)
+        return self._image_pyramid
+
+    def build_indexes(self):
+        # reverse lookups built once, so that queries do not rescan all traces and pins
+        traces = [set() for __ in self.ids.names]
+        for tid, trace in self.traces.items():
+            for idx in trace.components:
+                traces[idx].add(tid)
+        self.component_traces = dict(zip(self.ids.names, traces))
+        self.part_components = {}
+        for cid, c in self.components.items():
+            self.part_components.setdefault(c.part, set()).add(cid)
+
+    @property
+    def spatial_index(self):
+        # grid of component boxes, built on first spatial query
+        if self._spatial_index is None:
+            import board_spatial
+            self._spatial_index = board_spatial.SpatialIndex(self.components)
+        return self._spatial_index
+
+    def components_at(self, x, y):
+        return self.spatial_index.at(x, y)
+
+    def components_in(self, x0, y0, x1, y1):
+        return self.spatial_index.region(x0, y0, x1, y1)
+
+    def nearest_components(self, cid, k):
+        c = self.components.get(cid)
+        if c is None or "box" not in c:
+            return []
+        x, y = component_center(c)
+        return self.spatial_index.nearest(x, y, k, exclude=(cid,))
+
+    def net_graph(self, include_power=False):
+        # connectivity graph, power nets connect almost everything, so they are left out by default
+        if include_power not in self._net_graphs:
+            import board_graph
+            self._net_graphs[include_power] = board_graph.NetGraph(self.components, self.traces,
+                                                                   None if include_power else is_id_power)
+        return self._net_graphs[include_power]
+
+    def signal_graph(self, library_file=LIBRARY_FILE, include_power=False):
+        # signal flow between traces, following inputs and outputs of components described in the part library
+        key = (library_file, include_power)
+        if key not in self._signal_graphs:
+            parts = load_parts(library_file)
+            if parts is None:
+                return None
+            import board_parts
+            self._signal_graphs[key] = board_parts.SignalGraph(self.components, parts,
+                                                               None if include_power else is_id_power)
+        return self._signal_graphs[key]
+
+    @property
+    def box_centers(self):
+        # NumPy array of box centers of all components, in the order of the ID table
+        if self._box_centers is None:
+            import board_geometry
+            self._box_centers = board_geometry.box_centers(self.components, self.ids)
+        return self._box_centers
+
+    @property
+    def search_index(self):
+        # trigram index of IDs, parts, types, locations and trace names, built on first search
+        if self._search_index is None:
+            import board_search
+            self._search_index = board_search.SearchIndex()
+            self._search_index.add_board(None, [(key, c.part, c.type, c.location)
+                                                for key, c in self.components.items()], self.traces.keys())
+        return self._search_index
+
+    def traces_of(self, cids):
+        tids = set()
+        for cid in cids:
+            tids |= self.component_traces.get(cid, set())
+        return {key: self.traces[key] for key in self.traces.keys() if key in tids}
 
 
 def usage():
@@ -72,14 +232,43 @@ def usage():
     print(
         "  {:<33} {}".format("-c,--component <id1>[,<id2>,...]", "Display components (wildcards allowed for each ID)"))
     print("  {:<33} {}".format("-t,--trace <id1>[,<id2>,...]", "Display traces (wildcards allowed for each ID)"))
+    print("  {:<33} {}".format("-s,--search <text>[,<k>]", "Find k (default 20) best matching IDs, parts, names"))
+    print("  {:<33} {}".format("   --at <x>,<y>", "Display components at the board image pixel"))
+    print("  {:<33} {}".format("   --region <x1>,<y1>,<x2>,<y2>", "Display components overlapping the rectangle"))
+    print("  {:<33} {}".format("   --nearest <id>[,<k>]", "Display k (default 5) components nearest to the one"))
+    print("  {:<33} {}".format("   --path <id1>,<id2>", "Display shortest connection between components/traces"))
+    print("  {:<33} {}".format("   --hops <id>[,<n>]", "Display all within n (default 2) hops of component/trace"))
+    print("  {:<33} {}".format("   --connected", "Display groups of connected components and traces"))
+    print("  {:<33} {}".format("   --fan-in <id>|<id>-<pin>", "Display traces that can influence the trace"))
+    print("  {:<33} {}".format("   --fan-out <id>|<id>-<pin>", "Display traces that the trace can influence"))
+    print("  {:<33} {}".format("   --part <part1>[,<part2>,...]", "Display components of the parts (wildcards)"))
+    print("  {:<33} {}".format("   --page <n>", "Display components of the schematic page"))
     print()
     print("OPTIONAL:")
+    print("  {:<33} {}".format("   --cache", "Use compiled board cache stored next to the JSON file"))
     print("  {:<33} {}".format("   --colors", "Draw board image in colors (default is b & w)"))
+    print("  {:<33} {}".format("   --db <db-file>", "Query boards stored in SQLite database (-j imports)"))
     print("  {:<33} {}".format("-d,--detailed", "Display details about components or traces"))
+    print("  {:<33} {}".format("   --format text|json|jsonl|csv", "Output format (jsonl and csv with -c or -t only)"))
     print("  {:<33} {}".format("-g,--graphics", "Draw board image on screen"))
     print("  {:<33} {}".format("-h,--help", "Display help"))
+    print("  {:<33} {}".format("   --jobs <n>", "Render PDF pages (needs pypdf) or images in n processes"))
+    print("  {:<33} {}".format("   --jpeg", "Write JPEG instead of PNG images with --png-dir"))
+    print("  {:<33} {}".format("   --library <file>", "Part library for --fan-in/--fan-out"))
     print("  {:<33} {}".format("-m,--merge", "Merge and display/draw all concerning traces at once"))
     print("  {:<33} {}".format("-n,--neighbors", "Draw component neighbors too (valid with -c and -g)"))
+    print("  {:<33} {}".format("   --png-dir <directory>", "Write an image of every component or trace to directory"))
+    print("  {:<33} {}".format("   --power", "Follow power traces in --path, --hops and --connected"))
+    print("  {:<33} {}".format("   --profile <file>", "Write Chrome trace (.json) or cProfile statistics of the run"))
+    print("  {:<33} {}".format("   --render-cache <dir>[,<MB>]", "Reuse unchanged --pdf/--png-dir pages (1024 MB)"))
+    print("  {:<33} {}".format("   --timings", "Print time of the phases of the run and counters"))
+    print("  {:<33} {}".format("   --zoom", "Crop the board image to the drawn components"))
+    print()
+    print("QUERY SERVER:")
+    print("  {:<33} {}".format("   --repl", "Keep boards loaded and read queries interactively"))
+    print("  {:<33} {}".format("   --serve [<host>:]<port>", "Keep boards loaded and answer queries over HTTP"))
+    print("  {:<33} {}".format("   --allow-write", "Let server queries write files (--pdf, --png-dir etc.)"))
+    print("  {:<33} {}".format("   --connect [<host>:]<port>", "Send the query to a running server"))
     print()
     print("EXAMPLES:")
     print("  {} --json=a3-board.json -c* -d".format(prog_name))
@@ -94,25 +283,108 @@ def usage():
     exit()
 
 
+class IdFilter:
+    # compiled form of a comma separated list of IDs with file-style wildcards
+    def __init__(self, id_filter):
+        self.exact = set()
+        patterns = []
+        prefixes = []
+        for flt in split(",", id_filter):
+            m = re.search("[*?[]", flt)
+            if m is None:
+                self.exact.add(flt)
+            else:
+                patterns.append(fnmatch.translate(flt))
+                prefixes.append(flt[:m.start()])
+        self.regex = re.compile("|".join(patterns)) if len(patterns) > 0 else None
+        self.prefixes = None if "" in prefixes else tuple(prefixes)
+
+    def match(self, key):
+        if key in self.exact:
+            return True
+        if self.regex is None or (self.prefixes is not None and not key.startswith(self.prefixes)):
+            return False
+        return self.regex.match(key) is not None
+
+    def match_keys(self, keys):
+        matched = {key for key in self.exact if key in keys}
+        if self.regex is not None:
+            if self.prefixes is not None:
+                keys = [key for key in keys if key.startswith(self.prefixes)]
+            matched.update(key for key in keys if self.regex.match(key) is not None)
+        return matched
+
+
+@lru_cache(maxsize=64)
+def compile_filter(id_filter):
+    return IdFilter(id_filter)
+
+
+def match_keys(keys, id_filter):
+    return compile_filter(id_filter).match_keys(keys)
+
+
 def is_id_power(cid):
     return cid in ("GND", "+12V", "-12V", "+5V", "-5V", "+12FV", "-12FV", "+5FV", "-5FV", "GNDF")
 
 
-def load_json(fname, black_white):
+def load_image(fname, black_white):
+    import numpy
+    from PIL import Image
+    img = Image.open("./pictures/" + fname)
+    if black_white:
+        img = img.convert("L")
+    return numpy.flipud(numpy.asarray(img))
+
+
+@lru_cache(maxsize=4)
+def load_parts(fname):
+    import board_parts
+    try:
+        parts, warnings = board_parts.load_library(fname)
+    except IOError:
+        print("\nCan't open file:", fname, "\n")
+        return None
+    if len(warnings) > 0:
+        # pins without a type or lines that can't be parsed, the parts are used without them
+        print("Part library {}: {} warnings, the first one at line {}".format(fname, len(warnings), warnings[0]),
+              file=stderr)
+    return parts
+
+
+@gc_paused()
+def read_json(fname):
     try:
         file = open(fname, "r")
     except IOError:
         print("\nCan't open file:", fname, "\n")
         return
     try:
-        data = load(file)
+        return load(file)
     except json.JSONDecodeError as e:
         print("\nError decoding JSON file: {}\n".format(e))
         return
     finally:
         file.close()
+
+
+def load_json(fname, black_white, cache=False):
+    if cache:
+        import board_cache
+        cached = board_cache.load(fname)
+        if cached is not None:
+            data, model, image_loader = cached
+            return MotherBoard(data, black_white, image_loader if black_white else None, model)
+    data = read_json(fname)
+    if data is None:
+        return
     try:
         board = MotherBoard(data, black_white)
+        if cache and hasattr(board, "components"):
+            image = None
+            if "board_image" in data:
+                image = board.image if black_white else load_image(data["board_image"], True)
+            board_cache.save(fname, data, image)
     except IOError:
         print("\nCan't open board image file.\n")
         return
@@ -120,20 +392,15 @@ def load_json(fname, black_white):
 
 
 def format_pins(pins):
-    txt = ""
-    for idx, trace in enumerate(pins):
-        txt += "" if txt == "" else " "
-        txt += str(idx + 1) + "="
-        txt += "-" if trace == "" else trace
-    return " (" + txt + ")"
+    return " (" + " ".join(["{}={}".format(idx, trace or "-") for idx, trace in enumerate(pins, 1)]) + ")"
 
 
 def format_component(cid, c, id_width, part_width, adjust, show_pins):
     return "{}: {} {}{}".format(
         cid.rjust(id_width if adjust else 0),
-        (c["part"] + ("" if c["type"] == "" else "/" + c["type"])).ljust(part_width if adjust else 0),
-        c["location"].ljust(3 if adjust else 0),
-        format_pins(c["pins"]) if show_pins else ""
+        (c.part + ("" if c.type == "" else "/" + c.type)).ljust(part_width if adjust else 0),
+        c.location.ljust(3 if adjust else 0),
+        format_pins(c.pins) if show_pins else ""
     )
 
 
@@ -141,40 +408,82 @@ def format_trace(cid, trace, id_width, adjust):
     if is_id_power(cid):
         return "{}: ...".format(cid.rjust(id_width if adjust else 0))
     else:
-        trace.sort(key=lambda x: x[0][0] + x[0][1:].zfill(3) + str(x[1]).zfill(2))
-        txt = ""
-        for t in trace:
-            pin = "{}-{}".format(t[0], t[1] + 1)
-            txt += ("{:<8}" if adjust else "{} ").format(pin)
+        labels = trace.pin_labels()
+        txt = "".join([label.ljust(8) for label in labels] if adjust else [label + " " for label in labels])
         return "{}: {}".format(cid.rjust(id_width if adjust else 0), txt)
 
 
-def draw_text(txt, x, y, w, h, gca):
+@lru_cache(maxsize=1)
+def label_font():
+    return FontProperties(family="arial")
+
+
+@lru_cache(maxsize=2048)
+def text_path(txt):
+    # unit size outline of a label and its extents, labels repeat on many pages
+    tp = TextPath((0, 0), txt, size=1, prop=label_font())
+    return tp, tp.get_extents().bounds
+
+
+class OverlayBatch:
+    # overlays of a page are collected and added to the axes as a few collections at once,
+    # patches keep their drawing order within a collection
+    def __init__(self, ax):
+        self.ax = ax
+        self.patches = {}
+        self.lines = []
+        self.line_colors = []
+        self.line_widths = []
+
+    def add_patch(self, patch, zorder=1):
+        self.patches.setdefault(zorder, []).append(patch)
+
+    def add_line(self, points, color, width):
+        self.lines.append(points)
+        self.line_colors.append(color)
+        self.line_widths.append(width)
+
+    def flush(self):
+        for zorder, patches in sorted(self.patches.items()):
+            self.ax.add_collection(PatchCollection(patches, match_original=True, zorder=zorder, joinstyle="miter",
+                                                   capstyle="butt"), autolim=False)
+        if len(self.lines) > 0:
+            self.ax.add_collection(LineCollection(self.lines, colors=self.line_colors, linewidths=self.line_widths,
+                                                  zorder=0.5, joinstyle="miter", capstyle="butt"), autolim=False)
+        self.patches = {}
+        self.lines = []
+        self.line_colors = []
+        self.line_widths = []
+
+
+def draw_text(txt, x, y, w, h, batch):
     v_max_scale = 0.7
     h_max_scale = 0.8
 
     rotate = (abs(w) < abs(h))
-    fp = FontProperties(family="arial")
     fsize = w if rotate else h
-    tp = TextPath((0, 0), txt, size=fsize, prop=fp)
+    tp, (__, __, tw, th) = text_path(txt)
+    tw, th = tw * abs(fsize), th * abs(fsize)
+    transform = Affine2D().scale(fsize)
 
     bw, bh = w, h
-    (__, __, tw, th) = tp.get_extents().bounds
     if rotate:
-        tp = tp.transformed(Affine2D().rotate_deg(90).translate(th, 0))
+        transform.rotate_deg(90).translate(th, 0)
         bw, bh = bh, bw
 
     if tw < h_max_scale * bw:
         scale = v_max_scale * bh / th
     else:
         scale = h_max_scale * bw / tw
-    tp = tp.transformed(Affine2D().scale(scale))
-    (__, __, tw, th) = tp.get_extents().bounds
+    transform.scale(scale)
+    if rotate:
+        tw, th = th, tw
+    tw, th = abs(tw * scale), abs(th * scale)
 
-    tp = tp.transformed(Affine2D().translate(x + (w - tw) / 2, y + (h - th) / 2))
+    transform.translate(x + (w - tw) / 2, y + (h - th) / 2)
 
-    txt = PathPatch(tp, linewidth=0.3, facecolor="0", edgecolor="0")
-    gca.add_patch(txt)
+    txt = PathPatch(tp.transformed(transform), linewidth=0.3, facecolor="0", edgecolor="0")
+    batch.add_patch(txt)
 
 
 def draw_description(txt, gca):
@@ -182,18 +491,9 @@ def draw_description(txt, gca):
 
 
 def draw_component(cid, c, gca, edge_color=None):
-    if gca is not None and "box" in c:
-        colors = {"U": "#00ff00",
-                  "L": "#ff0000",
-                  "J": "#ffff00",
-                  "Q": "#ff0000",
-                  "P": "#ff00ff",
-                  "C": "#00ffff",
-                  "R": "#ff3388",
-                  "X": "#ff0000",
-                  "Y": "#33ff88",
-                  "T": "#9955ff"}
-        b = c["box"]
+    if gca is not None and c.box is not None:
+        colors = COMPONENT_COLORS
+        b = c.box
         t = cid[0]
         x = b[0]
         y = b[1]
@@ -202,52 +502,70 @@ def draw_component(cid, c, gca, edge_color=None):
         color = colors[t] if t in colors else "#000000"
         rect = Rectangle((x, y), w, h, linewidth=1.5 if edge_color is None else 2,
                          edgecolor=color if edge_color is None else edge_color, facecolor=color + "40", zorder=1)
-        gca[0].add_patch(rect)
-        draw_text(cid, x, y, w, h, gca[0])
+        gca[4].add_patch(rect)
+        gca[5].include(b)
+        draw_text(cid, x, y, w, h, gca[4])
 
 
 def draw_neighbors(board, cid, component, trace, gca):
     for t in board.traces[trace]:
         neighbor = board.components[t[0]]
-        if neighbor["id"] != cid and "box" in neighbor and "box" in component:
-            draw_component(neighbor["id"], neighbor, gca)
-            p = [component_center(neighbor), component_center(component)]
-            line = Polygon(p, closed=False, fill=False, linewidth=1, edgecolor="#ffffffff", zorder=0.5)
-            gca[0].add_patch(line)
+        if neighbor.id != cid and neighbor.box is not None and component.box is not None:
+            draw_component(neighbor.id, neighbor, gca)
+            gca[4].add_line([component_center(neighbor), component_center(component)], "#ffffffff", 1)
 
 
-def display_figure(figure, display, pdf):
+def display_figure(gca, display, pdf, close=True):
+    gca[4].flush()
+    gca[5].update()
+    figure = gca[3]
     if display:
         pyplot.show()
     if pdf is not None:
-        pdf.savefig(figure, dpi=60, orientation="portrait", facecolor="#ffffffff")
-    pyplot.close(figure)
+        save_figure(pdf, figure)
+    if close:
+        pyplot.close(figure)
+
+
+def save_figure(pdf, figure):
+    pdf.savefig(figure, dpi=PDF_DPI, orientation="portrait", facecolor="#ffffffff")
+
+
+def clear_gca(gca):
+    for ax in gca[:3]:
+        for artist in list(ax.patches) + list(ax.texts) + list(ax.lines) + list(ax.collections):
+            artist.remove()
 
 
-def print_components(board, component_filter, detailed, merged, neighbors, display, pdf, gca):
+def next_gca(board, gca, display):
+    # pages that are not shown on screen reuse the figure with the board image, only the overlays are replaced
+    if display:
+        return init_gca(board, identify=True, dpi=gca[5].dpi, zoom=gca[5].zoom)
+    clear_gca(gca)
+    return gca
+
+
+def print_components(board, component_filter, detailed, merged, neighbors, display, pdf, gca, distances=None):
     print()
-    filters = split(",", component_filter)
-    components = [board.components[key] for key in board.components.keys()
-                  if any([fnmatch.fnmatch(key, flt) for flt in filters])]
+    keys = match_keys(board.components, component_filter)
+    components = sorted_components(board, keys, distances)
     if len(components) == 0:
         return
-    components.sort(key=lambda x: x["id"][0] + x["id"][1:].zfill(4))
 
-    traces = {key: board.traces[key] for key in board.traces.keys()
-              if any([any([fnmatch.fnmatch(v, flt)
-                           for v in [t[0] for t in board.traces[key]]]) for flt in filters])}
+    traces = board.traces_of(keys)
 
     tid_width = max([len(key) for key in traces.keys()])
-    cid_width = max([len(c["id"]) for c in components])
+    cid_width = max([len(c.id) for c in components])
     id_width = max([tid_width, cid_width])
-    part_width = max([len(c["part"]) + len(c["type"]) + 1 for c in components])
+    part_width = max([len(c.part) + len(c.type) + 1 for c in components])
 
     for c in components:
-        cid = c["id"]
-        print(format_component(cid, c, cid_width, part_width, not detailed, not detailed))
+        cid = c.id
+        line = format_component(cid, c, cid_width, part_width, not detailed, not detailed)
+        print(line if distances is None else "{:>8.1f}  {}".format(distances[cid], line))
         if detailed:
             print()
-        for pin, t in enumerate(c["pins"]):
+        for pin, t in enumerate(c.pins):
             if detailed:
                 fmt = "-".rjust(id_width) if t == "" else format_trace(t, traces[t], id_width, True)
                 print("{:>2}: {}".format(pin + 1, fmt))
@@ -259,8 +577,8 @@ def print_components(board, component_filter, detailed, merged, neighbors, displ
             draw_component(cid, c, gca, edge_color="#ff0000ff" if neighbors else None)
             if not merged:
                 draw_description("Component: " + cid, gca[2])
-                display_figure(gca[3], display, pdf)
-                gca = init_gca(board)
+                display_figure(gca, display, pdf, close=display)
+                gca = next_gca(board, gca, display)
     if not detailed:
         print()
     if merged:
@@ -269,19 +587,35 @@ def print_components(board, component_filter, detailed, merged, neighbors, displ
         print()
         if gca is not None:
             draw_description("Component: multiple", gca[2])
-            display_figure(gca[3], display, pdf)
+            display_figure(gca, display, pdf)
+    elif gca is not None:
+        pyplot.close(gca[3])
+
+
+def component_sort_key(c):
+    return c.sort_key
+
+
+def sorted_components(board, keys, distances=None):
+    # components ordered by ID, or by the distance for --nearest
+    components = [board.components[key] for key in keys]
+    return sorted(components, key=component_sort_key if distances is None else lambda c: distances[c.id])
 
 
 def component_center(c):
-    b = c["box"]
+    b = c.box
     return b[0] + b[2] / 2, b[1] + b[3] / 2
 
 
+def trace_members(key, trace):
+    # pins of power traces are listed as they are sorted by IDs, pins of other traces in the natural order
+    return sorted(trace, key=lambda x: x[0] + str(x[1]).zfill(3)) if is_id_power(key) else trace.natural_order()
+
+
 def print_traces(board, trace_filter, detailed, merged, display, pdf, gca):
     print()
-    filters = split(",", trace_filter)
-    traces = {key: board.traces[key] for key in board.traces.keys()
-              if any([fnmatch.fnmatch(key, flt) for flt in filters])}
+    keys = match_keys(board.traces, trace_filter)
+    traces = {key: board.traces[key] for key in board.traces.keys() if key in keys}
     if len(traces) == 0:
         return
 
@@ -289,19 +623,20 @@ def print_traces(board, trace_filter, detailed, merged, display, pdf, gca):
 
     color = 0xff
     items = len(traces)
-    sorted_traces = sorted(traces.items())
-    for key, tr in sorted_traces:
-        tr.sort(key=lambda x: x[0] + str(x[1]).zfill(3))
+    sorted_traces = [(key, tr, trace_members(key, tr)) for key, tr in sorted(traces.items())]
+    if gca is not None:
+        polygons = trace_polygons(board, [[t[0] for t in members] for __, __, members in sorted_traces])
+    for n, (key, tr, members) in enumerate(sorted_traces):
         print(format_trace(key, tr, tid_width, not detailed))
 
-        cs = [(board.components[i[0]], i[1]) for i in tr]
-        cid_width = max([len(c["id"]) + 3 for (c, __) in cs])
-        part_width = max([len(c["part"]) + len(c["type"]) + 1 for (c, __) in cs])
+        cs = [(board.components[i[0]], i[1]) for i in members]
+        cid_width = max([len(c.id) + 3 for (c, __) in cs])
+        part_width = max([len(c.part) + len(c.type) + 1 for (c, __) in cs])
 
         if detailed:
             print()
         for (c, pin) in cs:
-            cid = c["id"]
+            cid = c.id
             if detailed:
                 print(format_component(cid + "-" + str(pin + 1), c, cid_width, part_width, True, False))
             draw_component(cid + ("-" + str(pin + 1) if not merged else ""), c, gca)
@@ -309,45 +644,607 @@ def print_traces(board, trace_filter, detailed, merged, display, pdf, gca):
         if detailed:
             print()
         if gca is not None:
-            p = [component_center(c) for (c, __) in cs if "box" in c]
-            if len(p) > 0:
-                center = reduce(lambda a, b: (a[0] + b[0], a[1] + b[1]), p, (0, 0))
-                center = (center[0] / len(p), (center[1] / len(p)))
-                p.sort(key=lambda a: math.atan2(a[1] - center[1], a[0] - center[0]))
-                q = int(color)
-                poly = Polygon(p, closed=True, fill=False, linewidth=2,
-                               edgecolor="#{:02X}{:02X}{:02X}".format(q, q, q), zorder=0.5)
-                gca[0].add_patch(poly)
+            q = int(color)
+            draw_trace_polygon(polygons[n], "#{:02X}{:02X}{:02X}".format(q, q, q), gca)
             if not merged:
                 draw_description("Trace: " + key, gca[2])
-                display_figure(gca[3], display, pdf)
-                gca = init_gca(board)
+                display_figure(gca, display, pdf, close=display)
+                gca = next_gca(board, gca, display)
             else:
                 draw_description("Traces: multiple", gca[2])
                 color = color - (0xff / items)
     if not detailed:
         print()
-    if merged:
-        display_figure(gca[3], display, pdf)
+    if gca is not None:
+        if merged:
+            display_figure(gca, display, pdf)
+        else:
+            pyplot.close(gca[3])
+
+
+def identify_click(board, gca, label, event):
+    # clicking the board image prints the components at the pixel
+    if event.inaxes is not gca[0] or event.xdata is None:
+        return
+    cids = board.components_at(event.xdata, event.ydata)
+    txt = "{:.0f},{:.0f}: ".format(event.xdata, event.ydata)
+    txt += ", ".join([format_component(cid, board.components[cid], 0, 0, False, False) for cid in cids]) or "-"
+    print(txt)
+    label.set_text(txt)
+    gca[3].canvas.draw_idle()
+
+
+class BoardView:
+    # part of the board image shown on a page, with zoom the view is cropped to the drawn components;
+    # the image is taken from the pyramid level matching the output resolution (full one on screen)
+    def __init__(self, board, ax, dpi, zoom):
+        self.board = board
+        self.ax = ax
+        self.dpi = dpi
+        self.zoom = zoom
+        self.bounds = None
+        self.shown = None
+        self.artist = None
+
+    def include(self, box):
+        x0, x1 = sorted((box[0], box[0] + box[2]))
+        y0, y1 = sorted((box[1], box[1] + box[3]))
+        if self.bounds is not None:
+            x0, y0 = min(x0, self.bounds[0]), min(y0, self.bounds[1])
+            x1, y1 = max(x1, self.bounds[2]), max(y1, self.bounds[3])
+        self.bounds = x0, y0, x1, y1
+
+    def region(self, width, height, ax_width, ax_height):
+        if not self.zoom or self.bounds is None:
+            return 0, 0, width, height
+        from board_pyramid import ZOOM_MARGIN
+        x0, y0, x1, y1 = self.bounds
+        x0, y0, x1, y1 = x0 - ZOOM_MARGIN, y0 - ZOOM_MARGIN, x1 + ZOOM_MARGIN, y1 + ZOOM_MARGIN
+        # grow the shorter side to the shape of the axes, so that the crop fills them
+        w = max(x1 - x0, (y1 - y0) * ax_width / ax_height)
+        h = max(y1 - y0, (x1 - x0) * ax_height / ax_width)
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        return max(0, cx - w / 2), max(0, cy - h / 2), min(width, cx + w / 2), min(height, cy + h / 2)
+
+    def update(self):
+        pyramid = self.board.image_pyramid
+        if pyramid is None:
+            return
+        height, width = pyramid.size()
+        fig_width, fig_height = self.ax.figure.get_size_inches()
+        pos = self.ax.get_position(original=True)
+        ax_width, ax_height = pos.width * fig_width, pos.height * fig_height
+        x0, y0, x1, y1 = self.region(width, height, ax_width, ax_height)
+        self.bounds = None
+        level = 0
+        if self.dpi is not None:
+            level = pyramid.level_for(min(ax_width * self.dpi / (x1 - x0), ax_height * self.dpi / (y1 - y0)))
+        f = 2 ** level
+        c0, c1 = int(x0 // f), int(math.ceil(x1 / f))
+        r0, r1 = int(y0 // f), int(math.ceil(y1 / f))
+        if (level, c0, c1, r0, r1) != self.shown:
+            if self.artist is not None:
+                self.artist.remove()
+            self.artist = self.ax.imshow(pyramid.level(level)[r0:r1, c0:c1], origin="lower", interpolation="nearest",
+                                         cmap=pyplot.get_cmap("Greys_r"), vmin=0, vmax=255,
+                                         extent=(c0 * f - 0.5, c1 * f - 0.5, r0 * f - 0.5, r1 * f - 0.5))
+            self.shown = (level, c0, c1, r0, r1)
+        self.ax.set_xlim(x0 - 0.5, x1 - 0.5)
+        self.ax.set_ylim(y0 - 0.5, y1 - 0.5)
+
+
+def trace_polygons(board, groups):
+    # vertices of the polygons linking groups of components, computed for all groups at once
+    import board_geometry
+    import numpy
+    sizes = numpy.fromiter(map(len, groups), dtype=int, count=len(groups))
+    indexes = numpy.fromiter(map(board.ids.index.__getitem__, chain.from_iterable(groups)), dtype=int,
+                             count=sizes.sum())
+    return board_geometry.polygons(board.box_centers, indexes, sizes)
+
+
+def draw_trace_polygon(points, color, gca):
+    if len(points) > 0:
+        poly = Polygon(points, closed=True, fill=False, linewidth=2, edgecolor=color, zorder=0.5)
+        gca[4].add_patch(poly, zorder=0.5)
+
+
+def graph_nodes(board, graph, nodes):
+    # IDs of components (in the board order of IDs) and traces from a list of graph nodes
+    cids = sorted([graph.names[n] for n in nodes if graph.is_component(n)],
+                  key=lambda cid: component_sort_key(board.components[cid]))
+    return {"components": cids, "traces": sorted([graph.names[n] for n in nodes if not graph.is_component(n)])}
+
+
+def signal_trace(board, name):
+    # trace given by its name or as a component pin, e.g. U128-3
+    if name in board.traces:
+        return name
+    cid, __, pin = name.rpartition("-")
+    c = board.components.get(cid)
+    if c is not None and pin.isdigit() and 1 <= int(pin) <= len(c.pins):
+        return c.pins[int(pin) - 1]
+    return None
+
+
+def cone_records(board, o):
+    fan_out = o.fan_out is not None
+    name = o.fan_out if fan_out else o.fan_in
+    net = signal_trace(board, name)
+    if net is None or net == "":
+        return {"error": "Unknown trace or unconnected component pin: " + name}
+    graph = board.signal_graph(o.library, o.power)
+    if graph is None:
+        return {"error": "Can't load part library: " + o.library}
+    levels = []
+    for traces, edges in graph.cone(net, fan_out):
+        through = [{"component": cid, "input": in_pin, "output": out_pin,
+                    "from": src if fan_out else dst, "to": dst if fan_out else src}
+                   for src, dst, cid, in_pin, out_pin in edges]
+        levels.append({"traces": traces, "through": through})
+    cone = {t for level in levels for t in level["traces"]}
+    undescribed = {t[0] for tid in cone for t in board.traces.get(tid, ()) if graph.parts.get(t[0]) is None}
+    return {"from": name, "trace": net, "direction": "fan-out" if fan_out else "fan-in", "levels": levels,
+            "undescribed": sorted(undescribed, key=lambda cid: component_sort_key(board.components[cid]))}
+
+
+def graph_records(board, o):
+    if o.fan_in is not None or o.fan_out is not None:
+        return cone_records(board, o)
+    graph = board.net_graph(o.power)
+    names = o.path if o.path is not None else [o.hops[0]] if o.hops is not None else []
+    nodes = [graph.node(name) for name in names]
+    if None in nodes:
+        return {"error": "Unknown component or trace (power traces need --power): " + names[nodes.index(None)]}
+    if o.path is not None:
+        path = graph.shortest_path(*nodes)
+        return {"from": o.path[0], "to": o.path[1],
+                "path": None if path is None else [{"component" if graph.is_component(n) else "trace": graph.names[n]}
+                                                   for n in path]}
+    if o.hops is not None:
+        return {"from": o.hops[0],
+                "hops": [graph_nodes(board, graph, level) for level in graph.within(nodes[0], o.hops[1])]}
+    return {"power": o.power, "groups": [graph_nodes(board, graph, group) for group in graph.connected_groups()],
+            "unconnected": sorted([cid for cid in board.components
+                                   if graph.offsets[graph.components[cid]] == graph.offsets[graph.components[cid] + 1]],
+                                  key=lambda cid: component_sort_key(board.components[cid]))}
+
+
+def trace_pins(board, tid, cid):
+    return "/".join([str(pin + 1) for pin in sorted([t[1] for t in board.traces[tid] if t[0] == cid])])
+
+
+def print_graph(board, records, detailed, display, pdf, gca):
+    print()
+    if "error" in records:
+        print(records["error"])
+        print()
+        return
+    drawn = set()
+    if "path" in records:
+        if records["path"] is None:
+            print("No connection from {} to {}".format(records["from"], records["to"]))
+            print()
+            return
+        path = [list(n.items())[0] for n in records["path"]]
+        print("Path from {} to {}, {} traces:".format(records["from"], records["to"],
+                                                     len([n for n in path if n[0] == "trace"])))
+        print()
+        width = max([len(name) for __, name in path])
+        for i, (kind, name) in enumerate(path):
+            if kind == "component":
+                print(format_component(name, board.components[name], width, 0, True, detailed))
+                drawn.add(name)
+                continue
+            prev = path[i - 1][1] if i > 0 else None
+            nxt = path[i + 1][1] if i + 1 < len(path) else None
+            print("{}: {} -> {}".format(name.rjust(width),
+                                        "-" if prev is None else prev + "-" + trace_pins(board, name, prev),
+                                        "-" if nxt is None else nxt + "-" + trace_pins(board, name, nxt)))
+            if gca is not None and prev is not None and nxt is not None and \
+                    board.components[prev].box is not None and board.components[nxt].box is not None:
+                gca[4].add_line([component_center(board.components[prev]), component_center(board.components[nxt])],
+                                "#ffffffff", 2)
+        title = "Path: {} - {}".format(records["from"], records["to"])
+    elif "hops" in records:
+        print("Within {} hops of {}:".format(len(records["hops"]) - 1, records["from"]))
+        print()
+        for i, level in enumerate(records["hops"]):
+            print("{:>2}: {}".format(i, " ".join(level["components"] + level["traces"])))
+            drawn.update(level["components"])
+        traces = [t for level in records["hops"] for t in level["traces"]]
+        title = "Hops: {}".format(records["from"])
+    elif "levels" in records:
+        through = [e for level in records["levels"] for e in level["through"]]
+        drawn.update([e["component"] for e in through])
+        print("{} of {}{}, {} traces through {} components:".format(
+            "Fan-out" if records["direction"] == "fan-out" else "Fan-in", records["from"],
+            "" if records["from"] == records["trace"] else " (" + records["trace"] + ")",
+            len([t for level in records["levels"] for t in level["traces"]]), len(drawn)))
+        print()
+        for i, level in enumerate(records["levels"]):
+            print("{:>2}: {}".format(i, " ".join(level["traces"])))
+            if detailed:
+                for e in level["through"]:
+                    print("      {} -> {}-{} => {}-{} -> {}".format(e["from"], e["component"], e["input"],
+                                                                 e["component"], e["output"], e["to"]))
+        if len(records["undescribed"]) > 0:
+            print()
+            print("Components without part description: " + " ".join(records["undescribed"]))
+        traces = [records["trace"]]
+        title = "{}: {}".format("Fan-out" if records["direction"] == "fan-out" else "Fan-in", records["from"])
+    else:
+        print("Connected groups{}: {}".format("" if records["power"] else " (power traces excluded)",
+                                              len(records["groups"])))
+        print()
+        for i, group in enumerate(records["groups"]):
+            members = ": " + " ".join(group["components"] + group["traces"]) if detailed or i > 0 else ""
+            print("{:>3}: {} components, {} traces{}".format(i + 1, len(group["components"]), len(group["traces"]),
+                                                             members))
+            if i > 0:
+                drawn.update(group["components"])
+        if len(records["unconnected"]) > 0:
+            print("  -: {} components without connections: {}".format(len(records["unconnected"]),
+                                                                      " ".join(records["unconnected"])))
+        traces = [t for group in records["groups"][1:] for t in group["traces"]]
+        title = "Connected groups"
+    print()
+    if gca is None:
+        return
+    if "path" not in records:
+        for points in trace_polygons(board, [[t[0] for t in board.traces[tid] if t[0] in drawn] for tid in traces]):
+            draw_trace_polygon(points, "#ffffffff", gca)
+    for cid in drawn:
+        draw_component(cid, board.components[cid], gca)
+    draw_description(title, gca[2])
+    display_figure(gca, display, pdf)
 
 
-def init_gca(board):
+def init_gca(board, identify=False, dpi=None, zoom=False):
+    import_graphics()
     fig = pyplot.figure(figsize=(14, 9))
     p0 = fig.add_subplot(3, 1, 1, position=[0, 0.95, 1, 0.05])
     p0.axis("off")
     p1 = fig.add_subplot(3, 1, 2, position=[0, 0.25, 1, 0.70])
     p1.axis("off")
-    p1.imshow(board.image, origin="lower", interpolation="nearest", cmap=pyplot.get_cmap("Greys_r"))
     p2 = fig.add_subplot(3, 1, 3, position=[0, 0.00, 1, 0.25], xlim=(0, 40), ylim=(0, 7))
     p2.axis("off")
-    return p1, p2, p0, fig
+    gca = p1, p2, p0, fig, OverlayBatch(p1), BoardView(board, p1, dpi, zoom)
+    gca[5].update()
+    if identify:
+        label = p2.text(0, 6, "", size=12)
+        fig.canvas.mpl_connect("button_press_event", lambda event: identify_click(board, gca, label, event))
+    return gca
 
 
-def main(main_argv):
+def pdf_info(json_file, component_filter):
+    return {"Title": ("Components of board " if component_filter is not None else "Traces of board ") + json_file,
+            "Author": "oldcrap.org",
+            "Subject": "Automatically generated file containing information about board components and traces",
+            "CreationDate": datetime.datetime.today(),
+            "ModDate": datetime.datetime.today()}
+
+
+def glob_escape(key):
+    return re.sub(r"([*?[])", r"[\1]", key)
+
+
+def page_ids(board, component_filter, trace_filter):
+    if component_filter is not None:
+        keys = match_keys(board.components, component_filter)
+        return [c.id for c in sorted([board.components[key] for key in board.components.keys() if key in keys],
+                                        key=component_sort_key)]
+    return sorted(match_keys(board.traces, trace_filter))
+
+
+worker_board = None
+
+
+def init_worker(json_file, black_white, cache, graphics=True):
+    global worker_board
+    if graphics:
+        import matplotlib
+        matplotlib.use("Agg")
+    worker_board = load_json(json_file, black_white, cache)
+
+
+class PageFiles:
+    # used instead of PdfPages, every page is saved to a PDF file of its own
+    def __init__(self, fnames):
+        self.fnames = iter(fnames)
+
+    def savefig(self, figure, **kwargs):
+        figure.savefig(next(self.fnames), format="pdf", **kwargs)
+
+
+def render_pdf_pages(board, ids, fnames, trace_pages, neighbors, zoom):
+    # text output was already printed by the main process
+    import_graphics()
+    with contextlib.redirect_stdout(io.StringIO()):
+        gca = init_gca(board, dpi=PDF_DPI, zoom=zoom)
+        id_filter = ",".join([glob_escape(i) for i in ids])
+        if trace_pages:
+            print_traces(board, id_filter, False, False, False, PageFiles(fnames), gca)
+        else:
+            print_components(board, id_filter, False, False, neighbors, False, PageFiles(fnames), gca)
+
+
+def run_worker(func, ids, fnames, *args):
+    return func(worker_board, ids, fnames, *args)
+
+
+def render_batches(board, json_file, black_white, cache, jobs, graphics, func, ids, fnames, *args):
+    # func(board, ids, fnames, *args) renders the pages of ids into files, with jobs > 1 in batches
+    # by worker processes, each of them loading the board once
+    if jobs == 1 or len(ids) == 1:
+        func(board, ids, fnames, *args)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    size = max(1, -(-len(ids) // (jobs * 4)))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(json_file, black_white, cache, graphics)) as executor:
+        futures = [executor.submit(run_worker, func, ids[i:i + size], fnames[i:i + size], *args)
+                   for i in range(0, len(ids), size)]
+        for f in futures:
+            f.result()
+
+
+def page_records(board, key, trace_page, neighbors):
+    # everything drawn on the page of a component or trace
+    if trace_page:
+        members = trace_members(key, board.traces[key])
+        return {"trace": key, "pins": [list(t) for t in members],
+                "components": [board.components[cid].to_dict() for cid in sorted({cid for cid, __ in members})]}
+    c = board.components[key]
+    records = {"component": c.to_dict()}
+    if neighbors:
+        traces = {t: board.traces[t].to_list() for t in c.pins if t != "" and not is_id_power(t)}
+        records["traces"] = traces
+        records["neighbors"] = [board.components[cid].to_dict()
+                                for cid in sorted({cid for trace in traces.values() for cid, __ in trace})]
+    return records
+
+
+def page_settings(board, renderer, version, neighbors, zoom):
+    import board_page_cache
+    image = "./pictures/" + board.image_file if board.image_file is not None else None
+    return {"renderer": renderer, "version": version, "image": board_page_cache.image_identity(image),
+            "colors": not board.black_white, "neighbors": neighbors, "zoom": zoom}
+
+
+def cached_pages(page_cache, board, ids, trace_pages, neighbors, settings, ext, render):
+    # files of the pages of ids from the render cache, missing pages are rendered first by render(ids, fnames)
+    import board_page_cache
+    keys = [board_page_cache.page_key(page_records(board, i, trace_pages, neighbors), settings) for i in ids]
+    files = {}
+    missing = []
+    for i, key in zip(ids, keys):
+        if key not in files:
+            files[key] = page_cache.get(key, ext)
+            if files[key] is None:
+                missing.append((i, key))
+    if len(missing) > 0:
+        with page_cache.temp_dir() as tmp:
+            fnames = [os.path.join(tmp, "{:05}{}".format(n, ext)) for n in range(len(missing))]
+            render([i for i, __ in missing], fnames)
+            for (__, key), fname in zip(missing, fnames):
+                files[key] = page_cache.put(key, ext, fname)
+    return [files[key] for key in keys]
+
+
+def compact_pdf(writer):
+    # pages showing the same view embed identical copies of the board image, they are stored once
+    if hasattr(writer, "compress_identical_objects"):
+        writer.compress_identical_objects()
+
+
+def compact_pdf_file(fname):
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        return
+    writer = PdfWriter(clone_from=fname)
+    compact_pdf(writer)
+    with open(fname, "wb") as f:
+        writer.write(f)
+
+
+def export_pdf_pages(board, json_file, black_white, cache, component_filter, trace_filter, neighbors, zoom,
+                     pdf_file, info, jobs, page_cache):
+    # pages rendered one by one into files (by jobs processes or taken from the render cache) and joined in order
+    import matplotlib
+    from pypdf import PdfWriter
+
+    ids = page_ids(board, component_filter, trace_filter)
+    if len(ids) == 0:
+        return
+    trace_pages = trace_filter is not None
+
+    def render(page_ids, fnames):
+        render_batches(board, json_file, black_white, cache, jobs, True, render_pdf_pages, page_ids, fnames,
+                       trace_pages, neighbors, zoom)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if page_cache is None:
+            parts = [os.path.join(tmp, "{:05}.pdf".format(i)) for i in range(len(ids))]
+            render(ids, parts)
+        else:
+            settings = page_settings(board, "pdf", [RENDER_VERSION, matplotlib.__version__, PDF_DPI], neighbors,
+                                     zoom)
+            parts = cached_pages(page_cache, board, ids, trace_pages, neighbors, settings, ".pdf", render)
+        writer = PdfWriter()
+        for part in parts:
+            writer.append(part)
+        writer.add_metadata({"/" + k: v.strftime("D:%Y%m%d%H%M%S") if isinstance(v, datetime.datetime) else v
+                             for k, v in info.items()})
+        compact_pdf(writer)
+        with open(pdf_file, "wb") as f:
+            writer.write(f)
+
+
+def raster_component(label, c, page, edge_color=None):
+    if c.box is not None:
+        color = COMPONENT_COLORS.get(label[0], "#000000")
+        page.add_box(c.box, color, color if edge_color is None else edge_color, 2 if edge_color is None else 3,
+                     label)
+
+
+def raster_pages(board, ids, trace_pages, neighbors, merged):
+    # (name, page) with the same overlays as the PDF pages of the components or traces, one for all when merged
+    import board_raster
+    pages = []
+    page = board_raster.RasterPage()
+    if trace_pages:
+        members = [trace_members(key, board.traces[key]) for key in ids]
+        polygons = trace_polygons(board, [[t[0] for t in m] for m in members])
+        color = 0xff
+        for key, m, points in zip(ids, members, polygons):
+            for cid, pin in m:
+                raster_component(cid + ("-" + str(pin + 1) if not merged else ""), board.components[cid], page)
+            if len(points) > 0:
+                q = int(color)
+                page.add_line(points, "#{:02X}{:02X}{:02X}".format(q, q, q), 2, closed=True)
+            if merged:
+                color = color - (0xff / len(ids))
+            else:
+                pages.append((key, page))
+                page = board_raster.RasterPage()
+    else:
+        for cid in ids:
+            c = board.components[cid]
+            if neighbors and c.box is not None:
+                for t in c.pins:
+                    if t == "" or is_id_power(t):
+                        continue
+                    for nid, __ in board.traces[t]:
+                        neighbor = board.components[nid]
+                        if neighbor.id != cid and neighbor.box is not None:
+                            raster_component(neighbor.id, neighbor, page)
+                            page.add_line([component_center(neighbor), component_center(c)], "#ffffff", 1)
+            raster_component(cid, c, page, edge_color="#ff0000" if neighbors else None)
+            if not merged:
+                pages.append((cid, page))
+                page = board_raster.RasterPage()
+    if merged:
+        pages.append(("traces" if trace_pages else "components", page))
+    return pages
+
+
+def raster_size(board):
+    # (height, width) of the area of all boxes, used as the page of boards without an image
+    width = height = 1
+    for c in board.components.values():
+        if c.box is not None:
+            width = max(width, c.box[0], c.box[0] + c.box[2])
+            height = max(height, c.box[1], c.box[1] + c.box[3])
+    return int(math.ceil(height)), int(math.ceil(width))
+
+
+def image_file_name(directory, name, fmt):
+    # trace names can contain characters like "/", they are escaped as in URLs
+    from urllib.parse import quote
+    return os.path.join(directory, quote(name, safe="+-_.") + (".jpg" if fmt == "jpeg" else ".png"))
+
+
+def render_images(board, pages, fnames, zoom, fmt):
+    import board_raster
+    size = raster_size(board) if board.image_file is None else None
+    for (__, page), fname in zip(pages, fnames):
+        board_raster.save_image(page.render(board.image_pyramid, size, zoom), fname, fmt)
+
+
+def render_image_pages(board, ids, fnames, trace_pages, neighbors, zoom, fmt):
+    render_images(board, raster_pages(board, ids, trace_pages, neighbors, False), fnames, zoom, fmt)
+
+
+def export_images(board, json_file, black_white, cache, component_filter, trace_filter, neighbors, merged, zoom,
+                  directory, fmt, jobs, page_cache):
+    # one image per component or trace (or one for all with -m) drawn by the raster renderer, without matplotlib
+    ids = page_ids(board, component_filter, trace_filter)
+    if len(ids) == 0:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        if board.image_pyramid is not None:
+            # built once here, the worker processes only map the stored levels
+            board.image_pyramid.size()
+    except IOError:
+        print("\nCan't open board image file or create directory:", directory, "\n")
+        return
+    trace_pages = trace_filter is not None
+    if merged:
+        pages = raster_pages(board, ids, trace_pages, neighbors, True)
+        render_images(board, pages, [image_file_name(directory, name, fmt) for name, __ in pages], zoom, fmt)
+        return
+    fnames = [image_file_name(directory, i, fmt) for i in ids]
+
+    def render(page_ids, page_files):
+        render_batches(board, json_file, black_white, cache, jobs, False, render_image_pages, page_ids, page_files,
+                       trace_pages, neighbors, zoom, fmt)
+
+    if page_cache is None:
+        render(ids, fnames)
+    else:
+        import shutil
+        import board_raster
+        from PIL import __version__ as pil_version
+        settings = page_settings(board, fmt, [board_raster.RASTER_VERSION, pil_version], neighbors, zoom)
+        for part, fname in zip(cached_pages(page_cache, board, ids, trace_pages, neighbors, settings,
+                                            os.path.splitext(fnames[0])[1], render), fnames):
+            shutil.copyfile(part, fname)
+
+
+class Options:
+    def __init__(self):
+        self.pdf_file = None
+        self.png_dir = None
+        self.search = None
+        self.render_cache = None
+        self.image_format = "png"
+        self.json_file = None
+        self.component_filter = None
+        self.trace_filter = None
+        self.neighbors = False
+        self.detailed = False
+        self.display = False
+        self.merged = False
+        self.black_white = True
+        self.cache = False
+        self.jobs = 1
+        self.serve = None
+        self.allow_write = False
+        self.connect = None
+        self.repl = False
+        self.at = None
+        self.region = None
+        self.nearest = None
+        # distances of the components found by --nearest, in their order
+        self.distances = None
+        self.zoom = False
+        self.path = None
+        self.hops = None
+        self.connected = False
+        self.power = False
+        self.format = "text"
+        self.fan_in = None
+        self.fan_out = None
+        self.library = LIBRARY_FILE
+        self.timings = False
+        self.profile_file = None
+        self.db_file = None
+        self.part = None
+        self.page = None
+
+
+def parse_options(main_argv):
     try:
         opts, args = getopt.getopt(
-            main_argv, "ghc:t:dmnj:p:",
-            ["graphics", "help", "component=", "trace=", "details", "merge", "neighbors", "json=", "pdf=", "colors"]
+            main_argv, "ghc:t:dmnj:p:s:",
+            ["graphics", "help", "component=", "trace=", "details", "merge", "neighbors", "json=", "pdf=", "colors",
+             "cache", "jobs=", "serve=", "allow-write", "connect=", "repl", "at=", "region=", "nearest=", "zoom",
+             "path=", "hops=", "connected", "power", "format=", "fan-in=", "fan-out=", "library=", "timings",
+             "profile=", "db=", "part=", "page=", "png-dir=", "jpeg",
+             "render-cache=", "search="]
         )
     except getopt.GetoptError:
         usage()
@@ -356,78 +1253,736 @@ def main(main_argv):
     if len(opts) == 0 or len(args) > 1:
         usage()
 
-    pdf_file = None
-    pdf = None
-    json_file = None
-    component_filter = None
-    trace_filter = None
-    neighbors = False
-    detailed = False
-    display = False
-    merged = False
-    gca = None
-    black_white = True
-
+    o = Options()
     for opt, arg in opts:
         if opt in ["-h", "--help"]:
             usage()
         elif opt in ["-j", "--json"]:
-            json_file = arg
+            o.json_file = arg
         elif opt in ["-p", "--pdf"]:
-            pdf_file = arg
+            o.pdf_file = arg
+        elif opt in ["--png-dir"]:
+            o.png_dir = arg
+        elif opt in ["--jpeg"]:
+            o.image_format = "jpeg"
+        elif opt in ["--render-cache"]:
+            directory, __, size = arg.rpartition(",") if re.search(",[0-9]+$", arg) else (arg, "", "")
+            if directory == "":
+                usage()
+            o.render_cache = (directory, int(size)) if size != "" else (directory,)
         elif opt in ["-c", "--component"]:
-            component_filter = arg.upper()
+            o.component_filter = arg.upper()
         elif opt in ["-t", "--trace"]:
-            trace_filter = arg.upper()
+            o.trace_filter = arg.upper()
+        elif opt in ["-s", "--search"]:
+            text, __, k = arg.rpartition(",") if re.search(",[0-9]+$", arg) else (arg, "", "")
+            if text == "" or k == "0":
+                usage()
+            o.search = (text, int(k) if k != "" else 20)
         elif opt in ["-d", "--details"]:
-            detailed = True
+            o.detailed = True
         elif opt in ["-m", "--merge"]:
-            merged = True
+            o.merged = True
         elif opt in ["-n", "--neighbors"]:
-            neighbors = True
+            o.neighbors = True
         elif opt in ["-g", "--graphics"]:
-            display = True
+            o.display = True
         elif opt in ["--colors"]:
-            black_white = False
-
-    if json_file is None:
+            o.black_white = False
+        elif opt in ["--cache"]:
+            o.cache = True
+        elif opt in ["--jobs"]:
+            if not arg.isdigit() or int(arg) < 1:
+                usage()
+            o.jobs = int(arg)
+        elif opt in ["--serve"]:
+            o.serve = arg
+        elif opt in ["--allow-write"]:
+            o.allow_write = True
+        elif opt in ["--connect"]:
+            o.connect = arg
+        elif opt in ["--repl"]:
+            o.repl = True
+        elif opt in ["--zoom"]:
+            o.zoom = True
+        elif opt in ["--path"]:
+            o.path = split(",", arg.upper())
+            if len(o.path) != 2 or "" in o.path:
+                usage()
+        elif opt in ["--hops"]:
+            cid, __, n = arg.upper().partition(",")
+            if cid == "" or (n != "" and not n.isdigit()):
+                usage()
+            o.hops = (cid, int(n) if n != "" else 2)
+        elif opt in ["--connected"]:
+            o.connected = True
+        elif opt in ["--fan-in"]:
+            o.fan_in = arg.upper()
+        elif opt in ["--fan-out"]:
+            o.fan_out = arg.upper()
+        elif opt in ["--library"]:
+            o.library = arg
+        elif opt in ["--power"]:
+            o.power = True
+        elif opt in ["--db"]:
+            o.db_file = arg
+        elif opt in ["--part"]:
+            o.part = arg.upper()
+        elif opt in ["--page"]:
+            if not arg.isdigit():
+                usage()
+            o.page = int(arg)
+        elif opt in ["--timings"]:
+            o.timings = True
+        elif opt in ["--profile"]:
+            o.profile_file = arg
+        elif opt in ["--format"]:
+            if arg not in ("text", "json", "jsonl", "csv"):
+                usage()
+            o.format = arg
+        elif opt in ["--at"]:
+            o.at = parse_numbers(arg, 2)
+        elif opt in ["--region"]:
+            o.region = parse_numbers(arg, 4)
+        elif opt in ["--nearest"]:
+            cid, __, k = arg.upper().partition(",")
+            if cid == "" or (k != "" and not k.isdigit()):
+                usage()
+            o.nearest = (cid, int(k) if k != "" else 5)
+    return o
+
+
+def parse_numbers(arg, count):
+    try:
+        numbers = [float(i) for i in split(",", arg)]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count:
         usage()
+    return numbers
+
+
+def run_search(index, o):
+    if [o.component_filter, o.trace_filter, o.at, o.region, o.nearest, o.part, o.page].count(None) != 7:
+        print("Define only one: -s or -c, -t, --at, --region, --nearest, --part, --page")
+    elif o.path is not None or o.hops is not None or o.connected or o.fan_in is not None or o.fan_out is not None:
+        print("Define only one: -s, --path, --hops, --connected, --fan-in or --fan-out")
+    elif o.display or o.pdf_file is not None or o.png_dir is not None:
+        print("Option -s can't be used with -g, --pdf or --png-dir")
+    elif o.format == "json":
+        print(json.dumps(search_records(index, o.search), indent=4))
+    elif o.format != "text":
+        print("Format {} is available with -c and -t only".format(o.format))
+    else:
+        print_search(index, o.search, o.detailed)
+
+
+def option_text(value):
+    # option value as it could be given on the command line
+    if isinstance(value, (list, tuple)):
+        return ",".join([option_text(v) for v in value])
+    return "{:g}".format(value) if isinstance(value, float) else str(value)
+
+
+def resolve_spatial(board, o):
+    # spatial queries are turned into a component filter with the found IDs
+    if o.at is None and o.region is None and o.nearest is None:
+        return True
+    if [o.component_filter, o.trace_filter, o.at, o.region, o.nearest].count(None) != 4:
+        print("Define only one: -c, -t, --at, --region or --nearest")
+        return False
+    if o.at is not None:
+        ids = board.components_at(*o.at)
+    elif o.region is not None:
+        ids = board.components_in(*o.region)
+    else:
+        found = board.nearest_components(*o.nearest)
+        ids = [cid for cid, __ in found]
+        o.distances = {board.components[cid].id: d for cid, d in found}
+    o.component_filter = ",".join([glob_escape(i) for i in ids])
+    return True
+
+
+def resolve_attributes(board, o):
+    # --part and --page narrow the component filter, without -c all components are searched
+    if o.part is None and o.page is None:
+        return True
+    if o.trace_filter is not None:
+        print("Define only one: -t or --part/--page")
+        return False
+    keys = match_keys(board.components, o.component_filter or "*")
+    if o.part is not None:
+        parts = match_keys(board.part_components, o.part)
+        keys = [key for key in keys if board.components[key].part in parts]
+    if o.page is not None:
+        keys = [key for key in keys if o.page in board.components[key].pages]
+    o.component_filter = ",".join([glob_escape(key) for key in sorted(keys)])
+    return True
+
+
+def run_query(board, o):
+    pdf = None
+    gca = None
 
-    board = load_json(json_file, black_white)
-    if board is None:
+    if o.search is not None:
+        run_search(board.search_index, o)
         return
 
-    if display or pdf_file is not None:
-        gca = init_gca(board)
+    if not resolve_spatial(board, o) or not resolve_attributes(board, o):
+        return
 
-    if component_filter is None and trace_filter is None:
+    if o.component_filter == "" and o.format == "text":
+        # --at, --region, --nearest, --part or --page found nothing
+        query = [("--at", o.at), ("--region", o.region), ("--nearest", o.nearest), ("--part", o.part),
+                 ("--page", o.page)]
+        print()
+        print("Nothing found for:", " ".join(["{} {}".format(opt, option_text(value))
+                                              for opt, value in query if value is not None]))
+        print()
+        return
+
+    graph = o.path is not None or o.hops is not None or o.connected or o.fan_in is not None or o.fan_out is not None
+    if o.component_filter is None and o.trace_filter is None and not graph:
         usage()
 
-    if component_filter is not None and trace_filter is not None:
+    if o.component_filter is not None and o.trace_filter is not None:
         print("Define only one: -c or -t")
         return
 
-    if pdf_file is not None:
+    if graph and (o.component_filter is not None or o.trace_filter is not None or
+                  [o.path, o.hops, o.connected or None, o.fan_in, o.fan_out].count(None) != 4):
+        print("Define only one: -c, -t, --path, --hops, --connected, --fan-in or --fan-out")
+        return
+
+    if graph and o.format == "json":
+        print(json.dumps(graph_records(board, o), indent=4))
+        return
+
+    if graph and o.png_dir is not None:
+        print("Option --png-dir is available with -c and -t only")
+        return
+
+    if o.format != "text":
+        if graph:
+            print("Format {} is available with -c and -t only".format(o.format))
+        elif o.display or o.pdf_file is not None or o.png_dir is not None:
+            print("Format {} can't be used with -g, --pdf or --png-dir".format(o.format))
+        else:
+            write_records(board, o.component_filter, o.trace_filter, o.format, o.distances)
+        return
+
+    page_cache = None
+    if o.render_cache is not None and (o.pdf_file is not None or o.png_dir is not None):
+        import board_page_cache
         try:
-            pdf = PdfPages(pdf_file)
+            page_cache = board_page_cache.PageCache(*o.render_cache)
+        except OSError:
+            print("\nCan't create directory:", o.render_cache[0], "\n")
+            return
+
+    # pages rendered separately are joined afterwards, by processes or from the render cache
+    separate = (o.jobs > 1 or page_cache is not None) and o.pdf_file is not None and not o.display and \
+        not o.merged and not graph
+    if separate:
+        try:
+            import pypdf
+        except ImportError:
+            print("\nModule pypdf is not available, rendering all pages in a single process.\n")
+            separate = False
+
+    if (o.display or o.pdf_file is not None) and not separate:
+        try:
+            gca = init_gca(board, identify=o.display, dpi=None if o.display else PDF_DPI, zoom=o.zoom)
+        except IOError:
+            print("\nCan't open board image file.\n")
+            return
+
+    if o.pdf_file is not None and not separate:
+        import_graphics()
+        try:
+            pdf = PdfPages(o.pdf_file)
         except IOError:
             usage()
-        d = pdf.infodict()
-        if component_filter is not None:
-            d["Title"] = "Components of board " + json_file
-        else:
-            d["Title"] = "Traces of board " + json_file
-        d["Author"] = "oldcrap.org"
-        d["Subject"] = "Automatically generated file containing information about board components and traces"
-        d["CreationDate"] = d["ModDate"] = datetime.datetime.today()
+        pdf.infodict().update(pdf_info(o.json_file, o.component_filter))
 
-    if component_filter is not None:
-        print_components(board, component_filter, detailed, merged, neighbors, display, pdf, gca)
-    elif trace_filter is not None:
-        print_traces(board, trace_filter, detailed, merged, display, pdf, gca)
+    if graph:
+        print_graph(board, graph_records(board, o), o.detailed, o.display, pdf, gca)
+    elif o.component_filter is not None:
+        print_components(board, o.component_filter, o.detailed, o.merged, o.neighbors, o.display, pdf, gca,
+                         o.distances)
+    elif o.trace_filter is not None:
+        print_traces(board, o.trace_filter, o.detailed, o.merged, o.display, pdf, gca)
 
     if pdf is not None:
         pdf.close()
+        compact_pdf_file(o.pdf_file)
+    if separate:
+        export_pdf_pages(board, o.json_file, o.black_white, o.cache, o.component_filter, o.trace_filter,
+                         o.neighbors, o.zoom, o.pdf_file, pdf_info(o.json_file, o.component_filter), o.jobs,
+                         page_cache)
+    if o.png_dir is not None:
+        export_images(board, o.json_file, o.black_white, o.cache, o.component_filter, o.trace_filter, o.neighbors,
+                      o.merged, o.zoom, o.png_dir, o.image_format, o.jobs, page_cache)
+    if page_cache is not None:
+        page_cache.evict()
+
+
+CSV_COMPONENT_FIELDS = ["id", "part", "type", "location", "pages", "pin_count", "pins", "x", "y", "w", "h"]
+CSV_TRACE_FIELDS = ["id", "pins"]
+
+
+class RecordWriter:
+    # prints records one by one as JSON Lines, CSV or a single JSON document, nothing is collected
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.count = 0
+        self.buffer = io.StringIO()
+        self.csv = csv.writer(self.buffer, lineterminator="\n")
+
+    def begin(self, name, fields):
+        if self.fmt == "json":
+            print("{}\n    {}: {{".format("{" if name == "components" else ",", json.dumps(name)), end="")
+        elif self.fmt == "csv":
+            self.row(fields)
+        self.count = 0
+
+    def row(self, values):
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.csv.writerow(values)
+        print(self.buffer.getvalue(), end="")
+
+    def component(self, c, distance=None):
+        if self.fmt == "csv":
+            self.row([c.id, c.part, c.type, c.location, " ".join([str(p) for p in c.pages]), c.pin_count,
+                      " ".join([t or "-" for t in c.pins])] + list(c.box or ("", "", "", "")) +
+                     ([] if distance is None else [round(distance, 1)]))
+            return
+        record = component_record(c, distance)
+        if self.fmt == "jsonl":
+            print(json.dumps(record, separators=(",", ":")))
+        else:
+            print("{}\n        {}: {}".format("," if self.count > 0 else "", json.dumps(c.id), json.dumps(record)),
+                  end="")
+        self.count += 1
+
+    def trace(self, tid, trace):
+        if self.fmt == "csv":
+            self.row([tid, " ".join(trace.pin_labels())])
+        elif self.fmt == "jsonl":
+            print(json.dumps({"id": tid, "pins": trace.to_list()}, separators=(",", ":")))
+        else:
+            print("{}\n        {}: {}".format("," if self.count > 0 else "", json.dumps(tid),
+                                             json.dumps(trace.to_list())), end="")
+        self.count += 1
+
+    def end(self, name):
+        if self.fmt == "json":
+            print("\n    " if self.count > 0 else "", end="")
+            print("}" if name == "components" else "}\n}", end="" if name == "components" else "\n")
+
+
+def component_record(c, distance=None):
+    record = c.to_dict()
+    if distance is not None:
+        record["distance"] = round(distance, 1)
+    return record
+
+
+def write_records(board, component_filter, trace_filter, fmt, distances=None):
+    # one record per selected component or trace, in the order of the text output;
+    # a JSON document has the form of the board JSON files (components and traces keyed by their IDs), so it
+    # can be loaded with -j: selected components and their traces
+    writer = RecordWriter(fmt)
+    if component_filter is not None:
+        keys = match_keys(board.components, component_filter)
+        writer.begin("components", CSV_COMPONENT_FIELDS + ([] if distances is None else ["distance"]))
+        for c in sorted_components(board, keys, distances):
+            writer.component(c, None if distances is None else distances[c.id])
+        writer.end("components")
+        if fmt != "json":
+            return
+        traces = board.traces_of(keys)
+    else:
+        if fmt == "json":
+            writer.begin("components", None)
+            writer.end("components")
+        traces = {key: board.traces[key] for key in sorted(match_keys(board.traces, trace_filter))}
+    writer.begin("traces", CSV_TRACE_FIELDS)
+    for tid, trace in traces.items():
+        writer.trace(tid, trace)
+    writer.end("traces")
+
+
+def search_records(index, search):
+    results = index.search(*search)
+    return {"search": search[0],
+            "results": [{"text": r.text, "field": r.field, "distance": r.distance,
+                         "ids": [cid if board is None else {"board": board, "id": cid} for board, cid in r.ids]}
+                        for r in results]}
+
+
+def print_search(index, search, detailed):
+    # matches of the texts (component IDs, parts, types, locations, trace names) grouped by the text and field,
+    # the number of edits is given for fuzzy matches
+    print()
+    results = index.search(*search)
+    if len(results) == 0:
+        print("Nothing found for:", search[0])
+        print()
+        return
+    text_width = max([len(r.text) for r in results])
+    for r in results:
+        ids = [cid if board is None else "{}:{}".format(board, cid) for board, cid in r.ids]
+        if not detailed and len(ids) > 10:
+            ids = ids[:10] + ["... ({} more)".format(len(ids) - 10)]
+        print("{}  {:<{}}  {:<9}  {}".format(r.distance if r.distance > 0 else " ", r.text, text_width, r.field,
+                                             " ".join(ids)))
+    print()
+
+
+def query_records(board, o):
+    if o.search is not None:
+        return search_records(board.search_index, o.search)
+    if not resolve_spatial(board, o) or not resolve_attributes(board, o):
+        return None
+    if o.path is not None or o.hops is not None or o.connected or o.fan_in is not None or o.fan_out is not None:
+        return graph_records(board, o)
+    if o.component_filter is not None:
+        keys = match_keys(board.components, o.component_filter)
+        components = sorted_components(board, keys, o.distances)
+        return {"components": {c.id: component_record(c, None if o.distances is None else o.distances[c.id])
+                               for c in components},
+                "traces": {key: trace.to_list() for key, trace in board.traces_of(keys).items()}}
+    keys = match_keys(board.traces, o.trace_filter or "")
+    return {"components": {}, "traces": {key: board.traces[key].to_list() for key in sorted(keys)}}
+
+
+class BoardSet:
+    # boards kept in memory by the query server and the interactive mode, together with their indexes and images
+    def __init__(self, cache):
+        self.cache = cache
+        self.boards = {}
+
+    def get(self, json_file, black_white):
+        key = (os.path.abspath(json_file), black_white)
+        if key not in self.boards:
+            board = load_json(json_file, black_white, self.cache)
+            if board is None or not hasattr(board, "components"):
+                return None
+            self.boards[key] = board
+        return self.boards[key]
+
+    def loaded(self, json_file, black_white):
+        return (os.path.abspath(json_file), black_white) in self.boards
+
+
+def execute(boards, args, default_json=None, fmt="text", allow_write=True):
+    # runs a single query given with the command line syntax, returns the printed text or the JSON records
+    # (an object with the printed "error" when the query gives no records)
+    out = io.StringIO()
+    result = None
+    with contextlib.redirect_stdout(out):
+        try:
+            o = parse_options(args)
+            if o is not None and not allow_write and [getattr(o, name) for name in WRITE_OPTIONS].count(None) != \
+                    len(WRITE_OPTIONS):
+                print("\nOptions writing files (--pdf, --png-dir, --render-cache, --db, --profile) are not allowed "
+                      "without --allow-write of the server\n")
+            elif o is not None:
+                if o.json_file is None:
+                    o.json_file = default_json
+                if o.json_file is None:
+                    usage()
+                board = boards.get(o.json_file, o.black_white)
+                if board is not None:
+                    if fmt == "json":
+                        result = query_records(board, o)
+                    else:
+                        run_query(board, o)
+        except SystemExit:
+            pass
+        except Exception as e:
+            # a failed query does not end the session
+            print("\nQuery failed: {}: {}\n".format(type(e).__name__, e))
+    if fmt == "json":
+        return result if result is not None else {"error": out.getvalue().strip()}
+    return out.getvalue()
+
+
+def run_repl(boards, json_file):
+    try:
+        import readline
+    except ImportError:
+        pass
+    print("Enter queries with the command line syntax (e.g. -cU1* -d), -j switches the board, 'quit' ends.")
+    while True:
+        try:
+            line = input("board> ").strip()
+        except EOFError:
+            print()
+            break
+        if line in ("quit", "exit"):
+            break
+        if line == "":
+            continue
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            print(e)
+            continue
+        o = None
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                o = parse_options(args)
+            except SystemExit:
+                pass
+        print(execute(boards, args, json_file), end="")
+        # the board becomes the current one only when it could be loaded
+        if o is not None and o.json_file is not None and boards.loaded(o.json_file, o.black_white):
+            json_file = o.json_file
+
+
+def split_address(address):
+    host, __, port = address.rpartition(":")
+    if not port.isdigit():
+        return None
+    return host or "127.0.0.1", int(port)
+
+
+def run_server(boards, address, json_file, allow_write=False):
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            start = time.perf_counter()
+            # a browser can send a cross-site POST with a plain text body, but it adds an Origin header and it
+            # can't set the JSON content type without asking the server first
+            if self.headers.get("Origin") is not None:
+                self.send_error(403, "Requests from web pages are not accepted")
+                return
+            if self.headers.get_content_type() != "application/json":
+                self.send_error(415, "Expected Content-Type: application/json")
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+                args = [str(a) for a in request["args"]]
+            except (ValueError, KeyError, TypeError):
+                self.send_error(400, "Expected JSON with list of arguments in 'args'")
+                return
+            fmt = request.get("format", "text")
+            status = 200
+            if any([a in ("-g", "--graphics", "--serve", "--connect", "--repl") for a in args]):
+                message = "Option not available when querying the server."
+                response = {"error": message} if fmt == "json" else {"output": "\n" + message + "\n"}
+            elif fmt == "json":
+                response = execute(boards, args, json_file, fmt, allow_write)
+            else:
+                response = {"output": execute(boards, args, json_file, allow_write=allow_write)}
+            if "error" in response:
+                status = 400
+            response["ms"] = (time.perf_counter() - start) * 1e3
+            body = json.dumps(response).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    try:
+        server = HTTPServer(address, QueryHandler)
+    except OSError as e:
+        print("\nCan't start server at {}:{}: {}\n".format(address[0], address[1], e))
+        return
+    print("Serving board queries at http://{}:{}/".format(address[0], address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print()
+    server.server_close()
+
+
+def run_client(address, main_argv):
+    from urllib.request import urlopen, Request
+    from urllib.error import URLError
+    args = []
+    skip = False
+    for a in main_argv:
+        if skip:
+            skip = False
+        elif a == "--connect":
+            skip = True
+        elif not a.startswith("--connect="):
+            args.append(a)
+    # paths are resolved by the server process, so they are repeated as absolute ones (the last option wins)
+    o = parse_options(args)
+    for opt, name in PATH_OPTIONS:
+        value = getattr(o, name)
+        if isinstance(value, tuple):
+            # --render-cache <dir>[,<MB>]
+            args += [opt, ",".join([os.path.abspath(value[0])] + [str(v) for v in value[1:]])]
+        elif value is not None:
+            args += [opt, os.path.abspath(value)]
+    body = json.dumps({"args": args}).encode("utf-8")
+    try:
+        request = Request("http://{}:{}/".format(*address), data=body, headers={"Content-Type": "application/json"})
+        with urlopen(request) as response:
+            print(json.loads(response.read().decode("utf-8"))["output"], end="")
+    except URLError as e:
+        print("\nCan't connect to server at {}:{}: {}\n".format(address[0], address[1], e.reason))
+
+
+def instrument(profiler):
+    # wrappers are installed only when profiling, a normal run calls the original functions
+    module = modules[__name__]
+    for name in ("import_graphics", "load_json", "load", "load_image", "run_query", "print_components",
+                 "print_traces", "print_graph", "graph_records", "init_gca", "next_gca", "display_figure",
+                 "save_figure", "trace_polygons", "draw_component", "draw_text", "compact_pdf_file",
+                 "export_pdf_pages", "render_pdf_pages", "raster_pages", "render_images", "export_images",
+                 "cached_pages", "run_search"):
+        profiler.time(module, name, "json.load" if name == "load" else None)
+    profiler.time(module, "run", "main")
+    profiler.time(MotherBoard, "build_indexes")
+    profiler.time(OverlayBatch, "flush")
+    profiler.time(BoardView, "update", "BoardView.update (imshow)")
+    profiler.count(OverlayBatch, "add_patch", "patches added")
+    profiler.count(OverlayBatch, "add_line", "lines added")
+    profiler.count(module, "init_gca", "figures created")
+    profiler.count(module, "save_figure", "pages saved")
+
+
+def main(main_argv):
+    o = parse_options(main_argv)
+    if o is None:
+        return
+
+    if not o.timings and o.profile_file is None:
+        run(o, main_argv)
+        return
+    import board_profile
+    profiler = board_profile.Profiler(trace=o.profile_file is not None and o.profile_file.endswith(".json"),
+                                      cprofile=o.profile_file is not None and not o.profile_file.endswith(".json"))
+    if o.timings or profiler.events is not None:
+        instrument(profiler)
+    paths = text_path.cache_info()
+    try:
+        run(o, main_argv)
+    finally:
+        profiler.stop()
+        # glyph outlines of this run (not of worker processes): built ones and ones reused from the cache
+        misses = text_path.cache_info().misses - paths.misses
+        hits = text_path.cache_info().hits - paths.hits
+        profiler.add_count("text paths built", misses)
+        profiler.add_count("text path cache hits", hits)
+        if hits + misses > 0:
+            profiler.add_count("text path cache hit rate [%]", round(100 * hits / (hits + misses), 1))
+        if "board_page_cache" in modules:
+            profiler.add_count("render cache hits", modules["board_page_cache"].PageCache.hits)
+            profiler.add_count("render cache misses", modules["board_page_cache"].PageCache.misses)
+        if o.timings:
+            profiler.report(stderr)
+        if o.profile_file is not None:
+            try:
+                profiler.dump(o.profile_file)
+            except IOError:
+                print("\nCan't open file:", o.profile_file, "\n")
+
+
+def run(o, main_argv):
+    for address in (o.serve, o.connect):
+        if address is not None and split_address(address) is None:
+            usage()
+    if o.connect is not None:
+        run_client(split_address(o.connect), main_argv)
+        return
+
+    if o.serve is not None or o.repl:
+        boards = BoardSet(o.cache)
+        if o.json_file is not None and boards.get(o.json_file, o.black_white) is None:
+            return
+        if o.serve is not None:
+            run_server(boards, split_address(o.serve), o.json_file, o.allow_write)
+        else:
+            run_repl(boards, o.json_file)
+        return
+
+    if o.db_file is not None:
+        run_db(o)
+        return
+
+    if o.json_file is None:
+        usage()
+
+    board = load_json(o.json_file, o.black_white, o.cache)
+    if board is None:
+        return
+
+    run_query(board, o)
+
+
+def run_db(o):
+    # the board given with -j is imported when it is not in the database yet or has changed,
+    # without -j the query is run for every board in the database
+    import sqlite3
+    import board_db
+    try:
+        db = board_db.BoardDatabase(o.db_file)
+        if o.json_file is not None:
+            if not db.is_current(o.json_file):
+                data = read_json(o.json_file)
+                if data is None:
+                    return
+                if "components" not in data or "traces" not in data:
+                    print("Json does not contain components/traces on top level.")
+                    return
+                db.import_board(o.json_file, data)
+            boards = [(db.board_id(o.json_file), o.json_file)]
+        else:
+            boards = db.boards()
+        if len(boards) > 1 and (o.display or o.pdf_file is not None or o.png_dir is not None):
+            print("Select a single board with -j to use -g, --pdf or --png-dir")
+            return
+        if o.search is not None:
+            # one index of all boards, read without loading the boards
+            import board_search
+            index = board_search.SearchIndex()
+            for bid, name in boards:
+                index.add_board(name if len(boards) > 1 else None, *db.search_rows(bid))
+            run_search(index, o)
+            db.close()
+            return
+        for bid, name in boards:
+            q = copy.copy(o)
+            if o.part is not None or o.page is not None:
+                if o.trace_filter is not None:
+                    print("Define only one: -t or --part/--page")
+                    return
+                keys = db.select_components(bid, o.component_filter, o.part, o.page)
+                q.component_filter = ",".join([glob_escape(key) for key in keys])
+                q.part = q.page = None
+            elif q.component_filter is not None and q.trace_filter is None:
+                keys = db.select_components(bid, q.component_filter)
+            elif q.trace_filter is not None and q.component_filter is None:
+                keys = db.select_traces(bid, q.trace_filter)
+            else:
+                keys = None
+            if keys is not None and len(boards) > 1 and len(keys) == 0:
+                continue
+            if len(boards) > 1:
+                print("\nBoard:", name)
+            if keys is not None:
+                # only the selected components or traces and the ones connected to them are read
+                data = db.load(bid, q.component_filter if q.trace_filter is None else None, q.trace_filter,
+                               is_id_power)
+            else:
+                data = db.load(bid)
+            run_query(MotherBoard(data, o.black_white), q)
+        db.close()
+    except sqlite3.Error as e:
+        print("\nDatabase error: {}\n".format(e))
 
 
 if __name__ == "__main__":
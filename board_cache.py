@@ -0,0 +1,270 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Compiled board cache. The board JSON is converted into a binary file stored
+# next to it (<board>.board.bin), which contains an interned string table, integer
+# arrays with pins, traces and boxes and the pre-flipped grayscale board image.
+# The image is memory-mapped when the cache is loaded, so no JPEG decoding is needed.
+#
+# File layout:
+#   magic (4 bytes), version (uint32), header length (uint32), header (JSON), arrays
+# Header holds the source file signature, the string table, other top level JSON
+# values and the offset, type and shape of every array. Arrays are 64-byte aligned.
+#
+
+import json
+import os
+import struct
+import sys
+from array import array
+from itertools import islice
+
+CACHE_MAGIC = b"RBTC"
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".board.bin"
+ALIGNMENT = 64
+
+COMPONENT_KEYS = {"box", "id", "location", "pages", "part", "pin_count", "pins", "type"}
+REQUIRED_KEYS = COMPONENT_KEYS - {"box"}
+
+
+def cache_name(json_file):
+    return os.path.splitext(json_file)[0] + CACHE_SUFFIX
+
+
+def file_signature(fname):
+    st = os.stat(fname)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def file_hash(fname):
+    import hashlib
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def image_name(data):
+    return "./pictures/" + data["board_image"] if "board_image" in data else None
+
+
+class StringTable:
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def add(self, s):
+        idx = self.index.get(s)
+        if idx is None:
+            idx = self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return idx
+
+
+def flatten(lists, dtype="<i4"):
+    import numpy
+    offsets = numpy.zeros(len(lists) + 1, dtype="<i4")
+    offsets[1:] = numpy.cumsum([len(i) for i in lists], dtype="<i8")
+    values = numpy.fromiter((v for i in lists for v in i), dtype=dtype, count=int(offsets[-1]))
+    return offsets, values
+
+
+def is_compilable(comps, traces, cidx):
+    # the cache holds only the component keys, integer boxes and traces of existing components, other boards
+    # are loaded from the JSON file every time
+    for c in comps:
+        if not COMPONENT_KEYS.issuperset(c.keys()) or not REQUIRED_KEYS.issubset(c.keys()):
+            return False
+        if "box" in c and (len(c["box"]) != 4 or any([v != int(v) for v in c["box"]])):
+            return False
+    return all([t[0] in cidx for tr in traces for t in tr])
+
+
+def compile_board(data, image):
+    import numpy
+    st = StringTable()
+    cids = list(data["components"].keys())
+    cidx = {cid: i for i, cid in enumerate(cids)}
+    comps = [data["components"][cid] for cid in cids]
+    tids = list(data["traces"].keys())
+    traces = [data["traces"][tid] for tid in tids]
+    if not is_compilable(comps, traces, cidx):
+        return None
+    arrays = {"fields": numpy.array([[st.add(cid), st.add(c["id"]), st.add(c["part"]), st.add(c["type"]),
+                                      st.add(c["location"]), c["pin_count"]] for cid, c in zip(cids, comps)],
+                                    dtype="<i4").reshape(-1, 6),
+              "boxes": numpy.array([c.get("box", [0, 0, 0, 0]) for c in comps], dtype="<i4").reshape(-1, 4),
+              "has_box": numpy.array(["box" in c for c in comps], dtype="u1")}
+    arrays["page_offsets"], arrays["pages"] = flatten([c["pages"] for c in comps])
+    arrays["pin_offsets"], arrays["pin_traces"] = flatten([[st.add(t) for t in c["pins"]] for c in comps])
+    arrays["trace_names"] = numpy.array([st.add(tid) for tid in tids], dtype="<i4")
+    arrays["trace_offsets"], arrays["trace_components"] = flatten([[cidx[t[0]] for t in tr] for tr in traces])
+    __, arrays["trace_pins"] = flatten([[t[1] for t in tr] for tr in traces])
+    if image is not None:
+        arrays["image"] = numpy.ascontiguousarray(image, dtype="u1")
+    extra = {k: v for k, v in data.items() if k not in ("components", "traces")}
+    return st.strings, extra, arrays
+
+
+def save(json_file, data, image):
+    compiled = compile_board(data, image)
+    if compiled is None:
+        return False
+    strings, extra, arrays = compiled
+    header = {"source": file_signature(json_file), "hash": file_hash(json_file),
+              "image": None, "strings": strings, "extra": extra, "arrays": {}}
+    img = image_name(data)
+    if img is not None and os.path.exists(img):
+        header["image"] = file_signature(img)
+    offset = 0
+    for name, a in arrays.items():
+        header["arrays"][name] = [offset, a.dtype.str, list(a.shape)]
+        offset += (a.nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    h = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    start = (12 + len(h) + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    fname = cache_name(json_file)
+    tmp = fname + ".tmp" + str(os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            f.write(CACHE_MAGIC + struct.pack("<II", CACHE_VERSION, len(h)) + h)
+            for name, a in arrays.items():
+                f.seek(start + header["arrays"][name][0])
+                f.write(a.tobytes())
+            f.truncate(start + offset)
+        os.replace(tmp, fname)
+    except IOError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
+
+def read_header(fname):
+    with open(fname, "rb") as f:
+        prefix = f.read(12)
+        if len(prefix) != 12 or prefix[:4] != CACHE_MAGIC:
+            return None
+        version, size = struct.unpack("<II", prefix[4:])
+        if version != CACHE_VERSION:
+            return None
+        header = json.loads(f.read(size).decode("utf-8"))
+    header["size"] = size
+    header["start"] = (12 + size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    return header
+
+
+def is_valid(header, json_file, data_image):
+    if data_image is not None and os.path.exists(data_image):
+        if header["image"] != file_signature(data_image):
+            return False
+    elif header["image"] is not None:
+        return False
+    return header["source"] == file_signature(json_file) or header["hash"] == file_hash(json_file)
+
+
+def update_source(fname, header, signature):
+    # the JSON file was touched but not changed: the new signature is stored, so that the file is not hashed on
+    # every load; the header is padded with spaces to keep the arrays in place
+    stored = {k: v for k, v in header.items() if k not in ("size", "start")}
+    stored["source"] = signature
+    h = json.dumps(stored, separators=(",", ":")).encode("utf-8")
+    if len(h) > header["size"]:
+        if (12 + len(h) + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT != header["start"]:
+            return
+    else:
+        h += b" " * (header["size"] - len(h))
+    try:
+        with open(fname, "r+b") as f:
+            f.write(CACHE_MAGIC + struct.pack("<II", CACHE_VERSION, len(h)) + h)
+    except IOError:
+        pass
+
+
+def map_image(fname, header):
+    import numpy
+    offset, dtype, shape = header["arrays"]["image"]
+    return numpy.memmap(fname, dtype=dtype, mode="r", offset=header["start"] + offset, shape=tuple(shape))
+
+
+def read_arrays(fname, header):
+    # integer tables are read with the array module, numpy is only needed to map the image
+    arrays = {}
+    with open(fname, "rb") as f:
+        for name, (offset, dtype, shape) in header["arrays"].items():
+            if name == "image":
+                continue
+            a = array("B" if dtype == "|u1" else "i")
+            count = 1
+            for n in shape:
+                count *= n
+            f.seek(header["start"] + offset)
+            a.frombytes(f.read(count * a.itemsize))
+            if a.itemsize > 1 and sys.byteorder != "little":
+                a.byteswap()
+            arrays[name] = a
+    return arrays
+
+
+def build_model(strings, arrays):
+    # board model records made directly from the tables, traces keep slices of the integer arrays; components are
+    # numbered in the order of the board, like in board_model.build_model
+    import board_model
+    strings = [sys.intern(s) for s in strings]
+    Component = board_model.Component
+    Trace = board_model.Trace
+    ids = board_model.IdTable()
+    boxes = arrays["boxes"]
+    pages = arrays["pages"]
+    pins = list(map(strings.__getitem__, arrays["pin_traces"]))
+    po = arrays["page_offsets"]
+    pino = arrays["pin_offsets"]
+    components = {}
+    fields = zip(*[iter(arrays["fields"])] * 6)
+    for i, ((key, cid, part, tp, location, pin_count), has_box) in enumerate(zip(fields, arrays["has_box"])):
+        key = strings[key]
+        ids.add(key)
+        components[key] = Component.from_fields(strings[cid], strings[part], strings[tp], strings[location], pin_count,
+                                                tuple(pins[pino[i]:pino[i + 1]]), tuple(pages[po[i]:po[i + 1]]),
+                                                tuple(boxes[4 * i:4 * i + 4]) if has_box else None)
+    tc = arrays["trace_components"]
+    tp = arrays["trace_pins"]
+    to = arrays["trace_offsets"]
+    traces = {}
+    for tid, start, end in zip(arrays["trace_names"], to, islice(to, 1, None)):
+        traces[strings[tid]] = Trace(ids, tc[start:end], tp[start:end])
+    return components, traces, ids
+
+
+def load(json_file):
+    # returns (other top level JSON values, board model, function mapping the grayscale image or None), or None if
+    # there is no valid cache
+    fname = cache_name(json_file)
+    try:
+        header = read_header(fname)
+        if header is None or not is_valid(header, json_file, image_name(header["extra"])):
+            return None
+        arrays = read_arrays(fname, header)
+        signature = file_signature(json_file)
+        if header["source"] != signature:
+            update_source(fname, header, signature)
+    except (IOError, ValueError, KeyError):
+        return None
+    image_loader = (lambda: map_image(fname, header)) if "image" in header["arrays"] else None
+    return header["extra"], build_model(header["strings"], arrays), image_loader
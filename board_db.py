@@ -0,0 +1,236 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# SQLite store of many boards. Components, their pins and pages and traces of
+# every imported board JSON file are kept in indexed tables, so that questions
+# across all boards (which boards use a part, what is on a page) and component
+# or trace filters of a single board are answered by SQLite. Only the rows
+# needed by a query are read back, in the form of a (partial) board JSON
+# dictionary, which board.py then prints and draws as usual. ID filters with
+# wildcards are translated to GLOB patterns, which use the indexes for prefixes.
+#
+
+import json
+import os
+import re
+import sqlite3
+import sys
+
+DB_VERSION = 1
+COMPONENT_KEYS = ("id", "part", "type", "location", "pin_count", "pins", "pages", "box")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS boards (
+    id INTEGER PRIMARY KEY, file TEXT UNIQUE NOT NULL, name TEXT NOT NULL, source TEXT NOT NULL, extra TEXT);
+CREATE TABLE IF NOT EXISTS components (
+    board INTEGER NOT NULL, id TEXT NOT NULL, seq INTEGER NOT NULL, part TEXT, type TEXT, location TEXT,
+    pin_count INTEGER, box_x REAL, box_y REAL, box_w REAL, box_h REAL, extra TEXT,
+    PRIMARY KEY (board, id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pins (
+    board INTEGER NOT NULL, component TEXT NOT NULL, pin INTEGER NOT NULL, trace TEXT NOT NULL,
+    PRIMARY KEY (board, component, pin)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pages (
+    board INTEGER NOT NULL, component TEXT NOT NULL, seq INTEGER NOT NULL, page INTEGER,
+    PRIMARY KEY (board, component, seq)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS traces (
+    board INTEGER NOT NULL, id TEXT NOT NULL, seq INTEGER NOT NULL, component TEXT NOT NULL, pin INTEGER NOT NULL,
+    position INTEGER NOT NULL, PRIMARY KEY (board, id, seq)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS components_part ON components (part, board);
+CREATE INDEX IF NOT EXISTS components_type ON components (type, board);
+CREATE INDEX IF NOT EXISTS pins_trace ON pins (trace, board);
+CREATE INDEX IF NOT EXISTS pages_page ON pages (page, board);
+CREATE INDEX IF NOT EXISTS traces_component ON traces (board, component);
+"""
+
+BOARD_TABLES = ("components", "pins", "pages", "traces")
+
+
+def file_signature(fname):
+    st = os.stat(fname)
+    return "{}:{}".format(st.st_mtime_ns, st.st_size)
+
+
+def glob_condition(column, id_filter):
+    # comma separated IDs with file-style wildcards as an SQL condition and its parameters;
+    # [!...] of fnmatch is [^...] in GLOB, everything else has the same meaning
+    exact = []
+    globs = []
+    for flt in re.split(",", id_filter):
+        if re.search("[*?[]", flt) is None:
+            exact.append(flt)
+        else:
+            globs.append(flt.replace("[!", "[^"))
+    conditions = ["{} GLOB ?".format(column)] * len(globs)
+    if len(exact) > 0:
+        conditions.append("{} IN ({})".format(column, ",".join("?" * len(exact))))
+    return "(" + " OR ".join(conditions) + ")", globs + exact
+
+
+class BoardDatabase:
+    def __init__(self, fname):
+        self.connection = sqlite3.connect(fname)
+        self.connection.executescript(SCHEMA)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0:
+            self.connection.execute("PRAGMA user_version = {}".format(DB_VERSION))
+        elif version != DB_VERSION:
+            raise sqlite3.DatabaseError("unsupported database version {}".format(version))
+
+    def close(self):
+        self.connection.close()
+
+    def board_id(self, json_file):
+        row = self.connection.execute("SELECT id FROM boards WHERE file = ?", (os.path.abspath(json_file),)).fetchone()
+        return None if row is None else row[0]
+
+    def boards(self):
+        # (id, name) of all boards
+        return self.connection.execute("SELECT id, name FROM boards ORDER BY name").fetchall()
+
+    def is_current(self, json_file):
+        row = self.connection.execute("SELECT source FROM boards WHERE file = ?",
+                                      (os.path.abspath(json_file),)).fetchone()
+        return row is not None and row[0] == file_signature(json_file)
+
+    def import_board(self, json_file, data):
+        # replaces the rows of the board read from the JSON file
+        fname = os.path.abspath(json_file)
+        extra = {k: v for k, v in data.items() if k not in ("components", "traces")}
+        with self.connection as db:
+            bid = self.board_id(fname)
+            if bid is None:
+                bid = db.execute("INSERT INTO boards (file, name, source, extra) VALUES (?, ?, ?, ?)",
+                                 (fname, os.path.splitext(os.path.basename(fname))[0], file_signature(fname),
+                                  json.dumps(extra))).lastrowid
+            else:
+                db.execute("UPDATE boards SET source = ?, extra = ? WHERE id = ?",
+                           (file_signature(fname), json.dumps(extra), bid))
+                for table in BOARD_TABLES:
+                    db.execute("DELETE FROM {} WHERE board = ?".format(table), (bid,))
+            db.executemany("INSERT INTO components VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [(bid, key, seq, c.get("part"), c.get("type"), c.get("location"), c.get("pin_count"))
+                            + tuple(c["box"] if "box" in c else (None,) * 4)
+                            + (component_extra(key, c),)
+                            for seq, (key, c) in enumerate(data["components"].items())])
+            db.executemany("INSERT INTO pins VALUES (?, ?, ?, ?)",
+                           [(bid, key, pin, t) for key, c in data["components"].items()
+                            for pin, t in enumerate(c.get("pins", []))])
+            db.executemany("INSERT INTO pages VALUES (?, ?, ?, ?)",
+                           [(bid, key, seq, page) for key, c in data["components"].items()
+                            for seq, page in enumerate(c.get("pages", []))])
+            db.executemany("INSERT INTO traces VALUES (?, ?, ?, ?, ?, ?)",
+                           [(bid, tid, seq, t[0], t[1], position)
+                            for position, (tid, trace) in enumerate(data["traces"].items())
+                            for seq, t in enumerate(trace)])
+        return bid
+
+    def select_components(self, bid, component_filter=None, part_filter=None, page=None):
+        # keys of components of the board matching all the given filters, in the board order
+        conditions = ["board = ?"]
+        params = [bid]
+        if component_filter is not None:
+            condition, p = glob_condition("id", component_filter)
+            conditions.append(condition)
+            params += p
+        if part_filter is not None:
+            condition, p = glob_condition("part", part_filter)
+            conditions.append(condition)
+            params += p
+        if page is not None:
+            conditions.append("id IN (SELECT component FROM pages WHERE page = ? AND board = ?)")
+            params += [page, bid]
+        return [r[0] for r in self.connection.execute(
+            "SELECT id FROM components WHERE {} ORDER BY seq".format(" AND ".join(conditions)), params)]
+
+    def select_traces(self, bid, trace_filter):
+        condition, params = glob_condition("id", trace_filter)
+        return [r[0] for r in self.connection.execute(
+            "SELECT id FROM traces WHERE board = ? AND seq = 0 AND {}".format(condition), [bid] + params)]
+
+    def search_rows(self, bid):
+        # (id, part, type, location) of the components and IDs of the traces of the board, for the search index
+        components = self.connection.execute("SELECT id, ifnull(part, ''), ifnull(type, ''), ifnull(location, '') "
+                                             "FROM components WHERE board = ? ORDER BY seq", (bid,)).fetchall()
+        traces = [r[0] for r in self.connection.execute("SELECT id FROM traces WHERE board = ? AND seq = 0 "
+                                                        "ORDER BY position", (bid,))]
+        return components, traces
+
+    def load(self, bid, component_filter=None, trace_filter=None, exclude_net=None):
+        # board JSON dictionary with the selected components and traces and everything needed to print and draw
+        # them: all traces of the components and the components on these traces (except excluded nets),
+        # or the components connected to the traces; without filters the whole board
+        extra = json.loads(self.connection.execute("SELECT extra FROM boards WHERE id = ?", (bid,)).fetchone()[0])
+        db = self.connection
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS selected_components (id TEXT PRIMARY KEY) WITHOUT ROWID")
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS selected_traces (id TEXT PRIMARY KEY) WITHOUT ROWID")
+        db.execute("DELETE FROM selected_components")
+        db.execute("DELETE FROM selected_traces")
+        if component_filter is None and trace_filter is None:
+            db.execute("INSERT INTO selected_components SELECT id FROM components WHERE board = ?", (bid,))
+            db.execute("INSERT INTO selected_traces SELECT DISTINCT id FROM traces WHERE board = ?", (bid,))
+        else:
+            if component_filter is not None:
+                condition, params = glob_condition("id", component_filter)
+                db.execute("INSERT INTO selected_components SELECT id FROM components WHERE board = ? AND " +
+                           condition, [bid] + params)
+                db.execute("INSERT OR IGNORE INTO selected_traces SELECT DISTINCT id FROM traces "
+                           "WHERE board = ? AND component IN selected_components", (bid,))
+            else:
+                condition, params = glob_condition("id", trace_filter)
+                db.execute("INSERT INTO selected_traces SELECT id FROM traces WHERE board = ? AND seq = 0 AND " +
+                           condition, [bid] + params)
+            exclude = component_filter is not None and exclude_net is not None
+            # deterministic functions are known to Python 3.8 and later only
+            db.create_function("exclude_net", 1, lambda tid: exclude and exclude_net(tid),
+                               **({"deterministic": True} if sys.version_info >= (3, 8) else {}))
+            db.execute("INSERT OR IGNORE INTO selected_components SELECT component FROM traces "
+                       "WHERE board = ? AND id IN selected_traces AND NOT exclude_net(id)", (bid,))
+        components = {}
+        for row in db.execute("SELECT id, part, type, location, pin_count, box_x, box_y, box_w, box_h, extra "
+                              "FROM components WHERE board = ? AND id IN selected_components ORDER BY seq", (bid,)):
+            c = {"id": row[0], "part": row[1], "type": row[2], "location": row[3], "pin_count": row[4],
+                 "pins": [], "pages": []}
+            if row[5] is not None:
+                c["box"] = [number(v) for v in row[5:9]]
+            c.update(json.loads(row[9]) if row[9] is not None else {})
+            components[row[0]] = c
+        for key, pin, trace in db.execute("SELECT component, pin, trace FROM pins WHERE board = ? AND "
+                                          "component IN selected_components ORDER BY component, pin", (bid,)):
+            components[key]["pins"].append(trace)
+        for key, page in db.execute("SELECT component, page FROM pages WHERE board = ? AND "
+                                    "component IN selected_components ORDER BY component, seq", (bid,)):
+            components[key]["pages"].append(page)
+        traces = {}
+        for tid, key, pin in db.execute("SELECT id, component, pin FROM traces WHERE board = ? AND "
+                                        "id IN selected_traces ORDER BY position, seq", (bid,)):
+            traces.setdefault(tid, []).append([key, pin])
+        data = dict(extra)
+        data["components"] = components
+        data["traces"] = traces
+        return data
+
+
+def component_extra(key, c):
+    extra = {k: v for k, v in c.items() if k not in COMPONENT_KEYS}
+    if c.get("id", key) != key:
+        extra["id"] = c["id"]
+    return json.dumps(extra) if len(extra) > 0 else None
+
+
+def number(v):
+    return int(v) if v == int(v) else v
@@ -0,0 +1,57 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Geometry of trace polygons computed for many traces at once. Centers of all
+# component boxes are kept in one NumPy array, the components of the traces are
+# concatenated into one index array with a segment number per point, and the
+# centroid of every trace, the angle of every point around it and the order of
+# the polygon vertices are computed with array operations instead of a Python
+# loop per trace. Centroids are summed in the order of the points, like before.
+#
+
+import numpy
+
+
+def box_centers(components, ids):
+    # (len(ids.names), 2) array of box centers, NaN for IDs without a box
+    centers = numpy.full((len(ids.names), 2), numpy.nan)
+    keys = [key for key, c in components.items() if c.box is not None]
+    if len(keys) > 0:
+        boxes = numpy.array([components[key].box for key in keys], dtype=float)
+        centers[[ids.index[key] for key in keys]] = boxes[:, :2] + boxes[:, 2:] / 2
+    return centers
+
+
+def polygons(centers, indexes, sizes):
+    # list of (n, 2) vertex arrays, one per group of center indexes (given as one flat array of indexes and
+    # the sizes of the groups), ordered by the angle around the centroid of the group; points without a box
+    # are left out, a group without any gives an empty array
+    points = centers[indexes]
+    segments = numpy.repeat(numpy.arange(len(sizes)), sizes)
+    valid = ~numpy.isnan(points[:, 0])
+    points = points[valid]
+    segments = segments[valid]
+    counts = numpy.bincount(segments, minlength=len(sizes))
+    divisor = numpy.maximum(counts, 1)
+    cx = numpy.bincount(segments, weights=points[:, 0], minlength=len(sizes)) / divisor
+    cy = numpy.bincount(segments, weights=points[:, 1], minlength=len(sizes)) / divisor
+    angles = numpy.arctan2(points[:, 1] - cy[segments], points[:, 0] - cx[segments])
+    # lexsort is stable, points with the same angle keep their order
+    points = points[numpy.lexsort((angles, segments))]
+    ends = numpy.cumsum(counts).tolist()
+    return [points[start:end] for start, end in zip([0] + ends[:-1], ends)]
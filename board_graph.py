@@ -0,0 +1,141 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Connectivity graph of a board. Components and nets (traces) are the nodes,
+# a component is linked with every net connected to one of its pins. Nodes are
+# numbered, components first, and the adjacency is kept in two integer arrays
+# (offsets and targets, compressed sparse row form), so that searches over boards
+# with tens of thousands of pins only walk flat arrays.
+#
+
+from array import array
+from collections import deque
+
+NET_PREFIX = "NET:"
+
+
+class NetGraph:
+    def __init__(self, components, traces, exclude_net=None):
+        self.names = list(components.keys())
+        self.component_count = len(self.names)
+        self.components = {cid: i for i, cid in enumerate(self.names)}
+        self.nets = {}
+        edges = []
+        for tid, trace in traces.items():
+            if exclude_net is not None and exclude_net(tid):
+                continue
+            net = self.nets[tid] = len(self.names)
+            self.names.append(tid)
+            for cidx in sorted({self.components[t[0]] for t in trace if t[0] in self.components}):
+                edges.append((cidx, net))
+        degree = array("i", [0]) * (len(self.names) + 1)
+        for a, b in edges:
+            degree[a + 1] += 1
+            degree[b + 1] += 1
+        for i in range(len(self.names)):
+            degree[i + 1] += degree[i]
+        self.offsets = degree
+        self.targets = array("i", [0]) * len(edges) * 2
+        fill = array("i", degree[:-1])
+        for a, b in edges:
+            self.targets[fill[a]] = b
+            fill[a] += 1
+            self.targets[fill[b]] = a
+            fill[b] += 1
+
+    def node(self, name):
+        # component IDs take precedence, a net with the same name as a component is given as NET:<name>
+        if name.startswith(NET_PREFIX):
+            return self.nets.get(name[len(NET_PREFIX):])
+        node = self.components.get(name)
+        return self.nets.get(name) if node is None else node
+
+    def is_component(self, node):
+        return node < self.component_count
+
+    def neighbors(self, node):
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def bfs(self, sources, max_depth=None, target=None):
+        # returns (distances, parents) arrays, -1 for nodes that were not reached
+        dist = array("i", [-1]) * len(self.names)
+        parent = array("i", [-1]) * len(self.names)
+        queue = deque()
+        for s in sources:
+            dist[s] = 0
+            queue.append(s)
+        offsets = self.offsets
+        targets = self.targets
+        while queue:
+            node = queue.popleft()
+            if node == target:
+                break
+            d = dist[node] + 1
+            if max_depth is not None and d > max_depth:
+                continue
+            for i in range(offsets[node], offsets[node + 1]):
+                n = targets[i]
+                if dist[n] < 0:
+                    dist[n] = d
+                    parent[n] = node
+                    queue.append(n)
+        return dist, parent
+
+    def shortest_path(self, source, target):
+        # list of nodes from source to target, alternating components and nets, or None
+        dist, parent = self.bfs([source], target=target)
+        if dist[target] < 0:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(parent[path[-1]])
+        path.reverse()
+        return path
+
+    def within(self, source, hops):
+        # nodes reachable in at most the given number of hops, grouped by the distance
+        dist, __ = self.bfs([source], max_depth=hops)
+        levels = [[] for __ in range(hops + 1)]
+        for node, d in enumerate(dist):
+            if d >= 0:
+                levels[d].append(node)
+        return levels
+
+    def connected_groups(self):
+        # groups of connected nodes, the largest first; nodes without any connection are left out
+        label = array("i", [-1]) * len(self.names)
+        groups = []
+        offsets = self.offsets
+        targets = self.targets
+        for start in range(len(self.names)):
+            if label[start] >= 0 or offsets[start] == offsets[start + 1]:
+                continue
+            label[start] = len(groups)
+            group = [start]
+            stack = [start]
+            while stack:
+                node = stack.pop()
+                for i in range(offsets[node], offsets[node + 1]):
+                    n = targets[i]
+                    if label[n] < 0:
+                        label[n] = label[start]
+                        group.append(n)
+                        stack.append(n)
+            groups.append(group)
+        groups.sort(key=lambda g: -len(g))
+        return groups
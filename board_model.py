@@ -0,0 +1,175 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Compact in-memory model of a board. Components are records with fixed slots
+# instead of dictionaries, IDs, parts and trace names are interned, so every
+# pin refers to a shared string, and a trace keeps its pins in two integer
+# arrays (component numbers and pin indexes). Sort keys of components are
+# computed once when the board is loaded. Records still answer c["part"] and
+# "box" in c, so code written for the JSON dictionaries keeps working.
+#
+
+from array import array
+from sys import intern
+
+COMPONENT_FIELDS = ("id", "part", "type", "location", "pin_count", "pins", "pages", "box")
+FIELD_SET = frozenset(COMPONENT_FIELDS)
+
+
+def component_key(cid):
+    return cid[0] + cid[1:].zfill(4)
+
+
+def member_key(cid):
+    return cid[0] + cid[1:].zfill(3)
+
+
+class Component:
+    __slots__ = COMPONENT_FIELDS + ("sort_key", "extra")
+
+    def __init__(self, key, c):
+        self.id = intern(c.get("id", key))
+        self.part = intern(c.get("part", ""))
+        self.type = intern(c.get("type", ""))
+        self.location = intern(c.get("location", ""))
+        self.pin_count = int(c.get("pin_count", 0))
+        self.pins = tuple(map(intern, c.get("pins", ())))
+        self.pages = tuple([int(p) for p in c.get("pages", ())])
+        self.box = tuple([int(v) if v == int(v) else v for v in c["box"]]) if "box" in c else None
+        self.sort_key = component_key(self.id)
+        self.extra = None if c.keys() <= FIELD_SET else {k: v for k, v in c.items() if k not in FIELD_SET}
+
+    @classmethod
+    def from_fields(cls, cid, part, type, location, pin_count, pins, pages, box):
+        # record of values already interned and converted, e.g. read from the board cache
+        c = cls.__new__(cls)
+        c.id = cid
+        c.part = part
+        c.type = type
+        c.location = location
+        c.pin_count = pin_count
+        c.pins = pins
+        c.pages = pages
+        c.box = box
+        c.sort_key = component_key(cid)
+        c.extra = None
+        return c
+
+    def __getitem__(self, key):
+        if key in COMPONENT_FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in COMPONENT_FIELDS:
+            return getattr(self, key) is not None
+        return self.extra is not None and key in self.extra
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def to_dict(self):
+        c = {"id": self.id, "part": self.part, "type": self.type, "location": self.location,
+             "pin_count": self.pin_count, "pins": list(self.pins), "pages": list(self.pages)}
+        if self.box is not None:
+            c["box"] = list(self.box)
+        if self.extra is not None:
+            c.update(self.extra)
+        return c
+
+
+class Trace:
+    # pins of a trace as (component ID, pin index) pairs, kept in the order of the board file
+    __slots__ = ("ids", "components", "pins", "natural", "labels")
+
+    def __init__(self, ids, components, pins):
+        self.ids = ids
+        self.components = components
+        self.pins = pins
+        self.natural = None
+        self.labels = None
+
+    def __len__(self):
+        return len(self.components)
+
+    def __iter__(self):
+        ids = self.ids.names
+        return zip([ids[i] for i in self.components], self.pins)
+
+    def __getitem__(self, idx):
+        return self.ids.names[self.components[idx]], self.pins[idx]
+
+    def natural_order(self):
+        # pins ordered by component (U5 before U12) and pin, the order is found on first use and kept
+        if self.natural is None:
+            keys = self.ids.member_keys
+            names = self.ids.names
+            order = sorted(zip([keys[c] + str(p).zfill(2) for c, p in zip(self.components, self.pins)],
+                               self.components, self.pins))
+            self.natural = [(names[c], p) for __, c, p in order]
+        return self.natural
+
+    def pin_labels(self):
+        # CID-PIN labels (pins counted from 1) in the natural order
+        if self.labels is None:
+            self.labels = ["{}-{}".format(cid, pin + 1) for cid, pin in self.natural_order()]
+        return self.labels
+
+    def to_list(self):
+        return [[cid, pin] for cid, pin in self]
+
+
+class IdTable:
+    # interned component IDs referred to by traces, with their sort keys
+    def __init__(self):
+        self.names = []
+        self.member_keys = []
+        self.index = {}
+
+    def add(self, cid):
+        idx = self.index.get(cid)
+        if idx is None:
+            idx = self.index[cid] = len(self.names)
+            cid = intern(cid)
+            self.names.append(cid)
+            self.member_keys.append(member_key(cid))
+        return idx
+
+
+def build_model(json_components, json_traces):
+    # returns (components, traces, IdTable), components are numbered first, in the order of the board
+    ids = IdTable()
+    index = ids.index
+    components = {}
+    for key, c in json_components.items():
+        ids.add(key)
+        components[intern(key)] = c if isinstance(c, Component) else Component(key, c)
+    traces = {}
+    for tid, trace in json_traces.items():
+        if isinstance(trace, Trace):
+            trace = trace.to_list()
+        members = array("i", [index.get(t[0], -1) for t in trace])
+        if -1 in members:
+            # pins of components missing in the board
+            members = array("i", [ids.add(t[0]) for t in trace])
+        traces[intern(tid)] = Trace(ids, members, array("i", [t[1] for t in trace]))
+    return components, traces, ids
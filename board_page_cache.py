@@ -0,0 +1,121 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Content-addressed cache of rendered pages. Every page (a single page PDF file
+# or an image) is stored under the SHA-256 hash of everything that is drawn on it:
+# the records of the component or trace and its neighbors, the members of the
+# traces, the identity of the board image, the color mode and the renderer with
+# its version. A page whose inputs did not change is found under the same key and
+# is not rendered again. Files are stored in 256 subdirectories by the first two
+# hex digits of the key, used files get their modification time updated and the
+# least recently used ones are removed when the cache grows over its size limit.
+#
+
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+PAGE_CACHE_VERSION = 1
+PAGE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=8)
+def file_identity(fname, signature):
+    # hash of the file contents, computed once per file version (signature is its mtime and size)
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def image_identity(fname):
+    if fname is None:
+        return None
+    st = os.stat(fname)
+    return file_identity(fname, (st.st_mtime_ns, st.st_size))
+
+
+def page_key(records, settings):
+    text = json.dumps([PAGE_CACHE_VERSION, settings, records], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class PageCache:
+    # pages found and rendered by this process, for --timings
+    hits = 0
+    misses = 0
+
+    def __init__(self, directory, max_size=PAGE_CACHE_SIZE):
+        # max_size in MB
+        self.directory = directory
+        self.max_size = max_size * (1 << 20)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, ext):
+        return os.path.join(self.directory, key[:2], key + ext)
+
+    def get(self, key, ext):
+        # path of the stored page or None, a found page counts as used
+        fname = self.path(key, ext)
+        try:
+            os.utime(fname)
+        except OSError:
+            PageCache.misses += 1
+            return None
+        PageCache.hits += 1
+        return fname
+
+    def put(self, key, ext, fname):
+        # moves the rendered file into the cache, it has to be on the same file system (e.g. from temp_dir())
+        target = self.path(key, ext)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(fname, target)
+        return target
+
+    def temp_dir(self):
+        import tempfile
+        return tempfile.TemporaryDirectory(prefix="tmp-", dir=self.directory)
+
+    def evict(self):
+        # removes the least recently used pages until the cache fits in its size
+        entries = []
+        total = 0
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir() or len(sub.name) != 2:
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                total += st.st_size
+        entries.sort()
+        removed = 0
+        for __, size, fname in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fname)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        return removed
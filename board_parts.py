@@ -0,0 +1,155 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Part library and signal flow of a board. The library is read from the
+# original/components.txt file, which describes pins of component parts: their
+# names, types and inputs driving each output. Board components are joined with
+# the library by their part (LS374 or S374 is found as 74374) or type (RESQW).
+# The signal flow graph links traces: a trace connected to an input of a component
+# is linked with every trace connected to an output driven by this input. Cones of
+# traces influencing a trace (fan-in) or influenced by it (fan-out) are found with
+# a search over this graph and kept for the following queries.
+#
+
+import re
+
+INPUT_TYPES = ("I", "C", "B")
+OUTPUT_TYPES = ("O", "B")
+
+
+class Part:
+    def __init__(self, pid, description):
+        self.id = pid
+        self.description = description
+        # pin number -> (name, type, tuple of input pin names)
+        self.pins = {}
+        self.numbers = {}
+
+    def add_pin(self, number, name, pin_type, inputs):
+        self.pins[number] = (name, pin_type, inputs)
+        self.numbers.setdefault(name, []).append(number)
+
+    def drivers(self, number):
+        # pin numbers of the inputs driving an output pin
+        name, pin_type, inputs = self.pins.get(number, ("", "", ()))
+        if pin_type not in OUTPUT_TYPES:
+            return []
+        return [n for i in inputs for n in self.numbers.get(i, []) if self.pins[n][1] in INPUT_TYPES]
+
+
+def parse_library(lines):
+    # returns (dictionary of parts, list of warnings)
+    parts = {}
+    warnings = []
+    part = None
+    for idx, line in enumerate(lines):
+        line = line.strip()
+        if line == "":
+            part = None
+            continue
+        m = re.match(r"(\d+)\s*=\s*([^,]*)(?:,\s*([A-Za-z]?))?\s*(?:,\s*\((.*)\))?\s*$", line)
+        if m is not None and part is not None:
+            inputs = tuple([i.strip() for i in m.group(4).split(",") if i.strip() not in ("", "-")]) \
+                if m.group(4) is not None else ()
+            pin_type = (m.group(3) or "").upper()
+            if pin_type == "":
+                warnings.append("{}: pin {} of {} has no type".format(idx + 1, m.group(1), part.id))
+            part.add_pin(int(m.group(1)), m.group(2).strip(), pin_type, inputs)
+            continue
+        m = re.match(r"([^,=]+),\s*\"?([^\"]*)\"?$", line)
+        if m is not None and part is None:
+            part = parts[m.group(1).strip()] = Part(m.group(1).strip(), m.group(2))
+            continue
+        warnings.append("{}: can't parse line: {}".format(idx + 1, line))
+    return parts, warnings
+
+
+def load_library(fname):
+    with open(fname, "r") as f:
+        return parse_library(f)
+
+
+def part_candidates(c):
+    part = c["part"]
+    candidates = [part]
+    m = re.match(r"^(?:74|54)?(?:ALS|AS|LS|HCT|HC|S|F|L|H)?(\d+)$", part)
+    if m is not None:
+        candidates.append("74" + m.group(1))
+    m = re.match(r"^(\d+)[A-Z]+$", part)
+    if m is not None:
+        candidates.append(m.group(1))
+    candidates.append(c["type"])
+    return candidates
+
+
+def find_part(parts, c):
+    for p in part_candidates(c):
+        if p in parts:
+            return parts[p]
+    return None
+
+
+class SignalGraph:
+    def __init__(self, components, parts, exclude_net=None):
+        self.parts = {cid: find_part(parts, c) for cid, c in components.items()}
+        # trace -> list of (driven trace, component, input pin, output pin), and the reverse
+        self.forward = {}
+        self.backward = {}
+        for cid, c in components.items():
+            part = self.parts[cid]
+            if part is None:
+                continue
+            for out_pin, out_net in enumerate(c["pins"], 1):
+                if out_net == "" or (exclude_net is not None and exclude_net(out_net)):
+                    continue
+                for in_pin in part.drivers(out_pin):
+                    if in_pin > len(c["pins"]):
+                        continue
+                    in_net = c["pins"][in_pin - 1]
+                    if in_net == "" or in_net == out_net or (exclude_net is not None and exclude_net(in_net)):
+                        continue
+                    self.forward.setdefault(in_net, []).append((out_net, cid, in_pin, out_pin))
+                    self.backward.setdefault(out_net, []).append((in_net, cid, in_pin, out_pin))
+        self.cones = {}
+
+    def undescribed(self):
+        return [cid for cid, part in self.parts.items() if part is None]
+
+    def cone(self, net, fan_out):
+        # levels of the cone: a list of (traces, edges) where edges lead from the previous level,
+        # edges are (trace of the previous level, trace, component, input pin, output pin)
+        key = (net, fan_out)
+        if key not in self.cones:
+            links = self.forward if fan_out else self.backward
+            seen = {net}
+            levels = [([net], [])]
+            while True:
+                traces = []
+                edges = []
+                for src in levels[-1][0]:
+                    for dst, cid, in_pin, out_pin in links.get(src, ()):
+                        edges.append((src, dst, cid, in_pin, out_pin))
+                        if dst not in seen:
+                            seen.add(dst)
+                            traces.append(dst)
+                if len(traces) == 0:
+                    break
+                new = set(traces)
+                levels.append((sorted(traces), [e for e in edges if e[1] in new]))
+            self.cones[key] = levels
+        return self.cones[key]
@@ -0,0 +1,113 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Timings of the phases of a board.py run. Functions of interest are replaced
+# with wrappers measuring their time or counting their calls, but only when
+# profiling was requested, so a normal run does not pay anything for it. The
+# phases can be printed as a table, written as a Chrome trace (JSON, viewed
+# in chrome://tracing or Perfetto) or the whole run can be recorded by cProfile.
+#
+
+import functools
+import json
+import os
+import time
+
+
+class Profiler:
+    def __init__(self, trace=False, cprofile=False):
+        # phase name -> [calls, total time, nesting depth of the first call]
+        self.phases = {}
+        self.counters = {}
+        self.events = [] if trace else None
+        self.depth = 0
+        self.origin = time.perf_counter()
+        self.cprofile = None
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def add_time(self, name, start, end):
+        phase = self.phases[name]
+        phase[0] += 1
+        phase[1] += end - start
+        if self.events is not None:
+            self.events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": 0,
+                                "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6})
+
+    def add_count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def time(self, owner, attr, name=None):
+        # replaces owner.attr (a module function or a method) with a timed wrapper
+        func = getattr(owner, attr)
+        name = name or attr
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            depth = self.depth
+            if name not in self.phases:
+                # phases are listed in the order of their first call
+                self.phases[name] = [0, 0.0, depth]
+            self.depth += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.depth = depth
+                self.add_time(name, start, time.perf_counter())
+        setattr(owner, attr, timed)
+
+    def count(self, owner, attr, name):
+        func = getattr(owner, attr)
+
+        @functools.wraps(func)
+        def counted(*args, **kwargs):
+            self.add_count(name)
+            return func(*args, **kwargs)
+        setattr(owner, attr, counted)
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+    def report(self, out):
+        total = time.perf_counter() - self.origin
+        print(file=out)
+        print("{:<36} {:>7} {:>11} {:>6}".format("phase", "calls", "time [ms]", "%"), file=out)
+        for name, (calls, t, depth) in self.phases.items():
+            print("{:<36} {:>7} {:>11.1f} {:>6.1f}".format("  " * depth + name, calls, t * 1e3, 100 * t / total),
+                  file=out)
+        print("{:<36} {:>7} {:>11.1f}".format("total", "", total * 1e3), file=out)
+        if len(self.counters) > 0:
+            print(file=out)
+            for name, n in sorted(self.counters.items()):
+                print("{:<36} {:>7}".format(name, n), file=out)
+        print(file=out)
+
+    def dump(self, fname):
+        # .json files get the Chrome trace, any other name the cProfile statistics (pstats format)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(fname)
+            return
+        events = list(self.events or [])
+        events.append({"name": "counters", "ph": "C", "pid": os.getpid(), "tid": 0,
+                       "ts": (time.perf_counter() - self.origin) * 1e6, "args": self.counters})
+        with open(fname, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
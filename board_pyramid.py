@@ -0,0 +1,121 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Multi-resolution pyramid of the board image. Level n holds the image scaled down
+# 2^n times (by averaging 2x2 pixel blocks of the previous level), level 0 is the
+# image itself. Levels above 0 are stored as NumPy arrays in a directory next to the
+# image (<image>.bw.pyramid or <image>.colors.pyramid) and are memory-mapped when
+# used, so pages drawn at a low resolution do not need to decode the original picture.
+#
+
+import json
+import math
+import os
+
+PYRAMID_VERSION = 1
+SMALLEST_LEVEL = 256
+# margin (in pixels of the board image) around the drawn components of a zoomed view, the same for PDF and raster pages
+ZOOM_MARGIN = 150
+
+
+def pyramid_dir(image_file, black_white):
+    return os.path.splitext(image_file)[0] + (".bw" if black_white else ".colors") + ".pyramid"
+
+
+def file_signature(fname):
+    st = os.stat(fname)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def half(image):
+    import numpy
+    # odd sizes are padded with the last row or column
+    pad = [(0, image.shape[0] % 2), (0, image.shape[1] % 2)] + [(0, 0)] * (image.ndim - 2)
+    a = numpy.pad(image, pad, mode="edge").astype("u2")
+    a = a[0::2, 0::2] + a[1::2, 0::2] + a[0::2, 1::2] + a[1::2, 1::2]
+    return ((a + 2) // 4).astype(image.dtype)
+
+
+class ImagePyramid:
+    def __init__(self, image_file, black_white, base_loader):
+        self.image_file = image_file
+        self.directory = pyramid_dir(image_file, black_white)
+        self.base_loader = base_loader
+        self.shape = None
+        self.count = 0
+        self.arrays = {}
+        self.load_info()
+
+    def level_file(self, n):
+        return os.path.join(self.directory, "level-{}.npy".format(n))
+
+    def load_info(self):
+        try:
+            with open(os.path.join(self.directory, "pyramid.json"), "r") as f:
+                info = json.load(f)
+            if info["version"] == PYRAMID_VERSION and info["source"] == file_signature(self.image_file):
+                self.shape = tuple(info["shape"])
+                self.count = info["levels"]
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def build(self):
+        import numpy
+        image = self.base_loader()
+        self.shape = tuple(image.shape[:2])
+        self.count = 1
+        while max(image.shape[:2]) > SMALLEST_LEVEL:
+            image = half(image)
+            self.arrays[self.count] = image
+            self.count += 1
+        tmp = os.path.join(self.directory, "pyramid.json.tmp" + str(os.getpid()))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for n in range(1, self.count):
+                numpy.save(self.level_file(n), self.arrays[n])
+            with open(tmp, "w") as f:
+                json.dump({"version": PYRAMID_VERSION, "source": file_signature(self.image_file),
+                           "shape": list(self.shape), "levels": self.count}, f)
+            os.replace(tmp, os.path.join(self.directory, "pyramid.json"))
+        except IOError:
+            # the levels are still used from memory
+            pass
+
+    def size(self):
+        # (height, width) of the original image
+        if self.shape is None:
+            self.build()
+        return self.shape
+
+    def level(self, n):
+        if n == 0:
+            return self.base_loader()
+        if self.shape is None:
+            self.build()
+        if n not in self.arrays:
+            import numpy
+            self.arrays[n] = numpy.load(self.level_file(n), mmap_mode="r")
+        return self.arrays[n]
+
+    def level_for(self, scale):
+        # the smallest level that still has at least one pixel per output pixel at the given scale
+        if self.shape is None:
+            self.build()
+        if scale >= 1:
+            return 0
+        return max(0, min(self.count - 1, int(math.floor(math.log2(1 / scale)))))
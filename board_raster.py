@@ -0,0 +1,218 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Raster renderer of board pages, an alternative to matplotlib for PNG and JPEG
+# images. The overlays of a page (component boxes with labels, neighbor lines and
+# trace polygons) are collected first and then drawn with NumPy directly on a copy
+# of the board image, taken from the image pyramid level matching the output size.
+# Box fills are alpha-blended, lines are sampled pixel by pixel and labels are
+# bitmaps rendered once per text with the Pillow default font and then scaled to
+# the box. Nothing here uses matplotlib, so pages can be rendered quickly and in
+# many worker processes at once.
+#
+
+import math
+from functools import lru_cache
+
+import numpy
+
+from board_pyramid import ZOOM_MARGIN
+
+RASTER_VERSION = 1
+RASTER_WIDTH = 1600
+RASTER_HEIGHT = 1000
+LABEL_SIZE = 32
+FILL_ALPHA = 0x40 / 0xff
+
+
+def rgb(color):
+    # "#rrggbb" or "#rrggbbaa", the alpha part is left out
+    return numpy.array([int(color[i:i + 2], 16) for i in (1, 3, 5)], dtype=numpy.float32)
+
+
+@lru_cache(maxsize=1)
+def label_font():
+    from PIL import ImageFont
+    try:
+        return ImageFont.load_default(size=LABEL_SIZE)
+    except TypeError:
+        # Pillow before 10.1 has only the small bitmap font
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=4096)
+def label_bitmap(txt):
+    # coverage of the label text (0-255), top row first, cropped to the glyphs
+    from PIL import Image, ImageDraw
+    font = label_font()
+    x0, y0, x1, y1 = font.getbbox(txt)
+    img = Image.new("L", (max(1, x1 - x0), max(1, y1 - y0)))
+    ImageDraw.Draw(img).text((-x0, -y0), txt, fill=255, font=font)
+    return numpy.asarray(img)
+
+
+def scaled_label(txt, width, height, rotate):
+    # label bitmap fitted into 80% of the width and 70% of the height of a box, like the PDF labels
+    from PIL import Image
+    bitmap = label_bitmap(txt)
+    if rotate:
+        bitmap = numpy.rot90(bitmap)
+    h, w = bitmap.shape
+    scale = min(0.8 * width / w, 0.7 * height / h)
+    size = int(round(w * scale)), int(round(h * scale))
+    if size[0] < 1 or size[1] < 1:
+        return None
+    return numpy.asarray(Image.fromarray(numpy.ascontiguousarray(bitmap)).resize(size, Image.BILINEAR))
+
+
+@lru_cache(maxsize=2)
+def rgb_level(pyramid, level):
+    # the overlays are drawn in colors also on a black and white image, the converted level is shared by pages
+    image = pyramid.level(level)
+    canvas = numpy.empty(image.shape[:2] + (3,), dtype=numpy.uint8)
+    canvas[...] = image[:, :, None] if image.ndim == 2 else image[:, :, :3]
+    return canvas
+
+
+class RasterPage:
+    # overlays of a page in board coordinates, lines are drawn first and boxes over them in the order of adding
+    def __init__(self):
+        self.boxes = []
+        self.lines = []
+        self.bounds = None
+
+    def add_box(self, box, color, edge_color, edge_width, label):
+        self.boxes.append((tuple(box), color, edge_color, edge_width, label))
+        self.include(box)
+
+    def add_line(self, points, color, width, closed=False):
+        points = [tuple(p) for p in points]
+        if closed and len(points) > 2:
+            points.append(points[0])
+        self.lines.append((points, color, width))
+
+    def include(self, box):
+        x0, x1 = sorted((box[0], box[0] + box[2]))
+        y0, y1 = sorted((box[1], box[1] + box[3]))
+        if self.bounds is not None:
+            x0, y0 = min(x0, self.bounds[0]), min(y0, self.bounds[1])
+            x1, y1 = max(x1, self.bounds[2]), max(y1, self.bounds[3])
+        self.bounds = x0, y0, x1, y1
+
+    def region(self, width, height, zoom):
+        if not zoom or self.bounds is None:
+            return 0, 0, width, height
+        x0, y0, x1, y1 = self.bounds
+        return (max(0, x0 - ZOOM_MARGIN), max(0, y0 - ZOOM_MARGIN),
+                min(width, x1 + ZOOM_MARGIN), min(height, y1 + ZOOM_MARGIN))
+
+    def render(self, pyramid, size, zoom=False):
+        # RGB image (top row first) of the page on the board image from the pyramid, or on a black
+        # background of the given (height, width) when the board has no image
+        height, width = pyramid.size() if pyramid is not None else size
+        x0, y0, x1, y1 = self.region(width, height, zoom)
+        scale = min(RASTER_WIDTH / max(1, x1 - x0), RASTER_HEIGHT / max(1, y1 - y0))
+        if pyramid is not None:
+            level = pyramid.level_for(scale)
+        else:
+            level = 0 if scale >= 1 else int(math.floor(math.log2(1 / scale)))
+        f = 2 ** level
+        c0, c1 = int(x0 // f), int(math.ceil(x1 / f))
+        r0, r1 = int(y0 // f), int(math.ceil(y1 / f))
+        if pyramid is not None:
+            canvas = rgb_level(pyramid, level)[r0:r1, c0:c1].copy()
+        else:
+            canvas = numpy.zeros((r1 - r0, c1 - c0, 3), dtype=numpy.uint8)
+        # board coordinates to pixels of the canvas, pixel n of the level covers n * f - 0.5 to (n + 1) * f - 0.5
+        to_canvas = numpy.array([c0, r0], dtype=float)
+        for points, color, width in self.lines:
+            draw_polyline(canvas, (numpy.array(points, dtype=float) + 0.5) / f - to_canvas, rgb(color), width)
+        for box, color, edge_color, edge_width, label in self.boxes:
+            bx0, bx1 = sorted((box[0], box[0] + box[2]))
+            by0, by1 = sorted((box[1], box[1] + box[3]))
+            u0, v0 = (bx0 + 0.5) / f - c0, (by0 + 0.5) / f - r0
+            u1, v1 = (bx1 + 0.5) / f - c0, (by1 + 0.5) / f - r0
+            draw_box(canvas, u0, v0, u1, v1, rgb(color), rgb(edge_color), edge_width)
+            if label is not None:
+                draw_label(canvas, label, u0, v0, u1, v1, abs(box[2]) < abs(box[3]))
+        return numpy.flipud(canvas)
+
+
+def blend(canvas, r0, r1, c0, c1, color, alpha):
+    r0, r1 = max(0, r0), min(canvas.shape[0], r1)
+    c0, c1 = max(0, c0), min(canvas.shape[1], c1)
+    if r0 < r1 and c0 < c1:
+        if alpha == 1:
+            canvas[r0:r1, c0:c1] = color
+        else:
+            area = canvas[r0:r1, c0:c1].astype(numpy.float32)
+            canvas[r0:r1, c0:c1] = area + (color - area) * alpha + 0.5
+
+
+def draw_box(canvas, u0, v0, u1, v1, color, edge_color, edge_width):
+    c0, c1, r0, r1 = int(round(u0)), int(round(u1)), int(round(v0)), int(round(v1))
+    blend(canvas, r0, r1, c0, c1, color, FILL_ALPHA)
+    # the outline is centered on the edges of the box
+    a, b = edge_width // 2, edge_width - edge_width // 2
+    blend(canvas, r0 - a, r0 + b, c0 - a, c1 + b, edge_color, 1)
+    blend(canvas, r1 - a, r1 + b, c0 - a, c1 + b, edge_color, 1)
+    blend(canvas, r0 + b, r1 - a, c0 - a, c0 + b, edge_color, 1)
+    blend(canvas, r0 + b, r1 - a, c1 - a, c1 + b, edge_color, 1)
+
+
+def draw_label(canvas, txt, u0, v0, u1, v1, rotate):
+    bitmap = scaled_label(txt, u1 - u0, v1 - v0, rotate)
+    if bitmap is None:
+        return
+    # the canvas has the bottom row first
+    bitmap = numpy.flipud(bitmap)
+    h, w = bitmap.shape
+    r0 = int(round((v0 + v1 - h) / 2))
+    c0 = int(round((u0 + u1 - w) / 2))
+    rs, cs = max(0, -r0), max(0, -c0)
+    re, ce = min(h, canvas.shape[0] - r0), min(w, canvas.shape[1] - c0)
+    if rs < re and cs < ce:
+        area = canvas[r0 + rs:r0 + re, c0 + cs:c0 + ce]
+        area[...] = area * (1 - bitmap[rs:re, cs:ce, None] / 255) + 0.5
+
+
+def draw_polyline(canvas, points, color, width):
+    # every segment is sampled once per pixel of its longer side, wider lines are drawn with a square pen
+    if len(points) < 2:
+        return
+    starts, ends = points[:-1], points[1:]
+    steps = numpy.maximum(numpy.ceil(numpy.abs(ends - starts).max(axis=1)), 1).astype(int)
+    segments = numpy.repeat(numpy.arange(len(steps)), steps + 1)
+    offsets = numpy.arange(len(segments)) - numpy.repeat(numpy.cumsum(steps + 1) - steps - 1, steps + 1)
+    t = (offsets / steps[segments])[:, None]
+    samples = numpy.floor(starts[segments] + (ends[segments] - starts[segments]) * t).astype(int)
+    pen = numpy.arange(width) - (width - 1) // 2
+    shape = (len(samples), width, width)
+    rows = numpy.broadcast_to(samples[:, 1, None, None] + pen[None, :, None], shape).ravel()
+    cols = numpy.broadcast_to(samples[:, 0, None, None] + pen[None, None, :], shape).ravel()
+    inside = (rows >= 0) & (rows < canvas.shape[0]) & (cols >= 0) & (cols < canvas.shape[1])
+    canvas[rows[inside], cols[inside]] = color
+
+
+def save_image(image, fname, fmt):
+    from PIL import Image
+    img = Image.fromarray(image)
+    if fmt == "jpeg":
+        img.save(fname, "JPEG", quality=90)
+    else:
+        img.save(fname, "PNG", compress_level=1)
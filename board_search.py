@@ -0,0 +1,185 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Trigram search index of component IDs, parts, types, locations and trace names
+# of one or more boards. Every distinct (upper case) text is stored once, with a
+# linked list of the entries (board, field, ID) having this text, and every
+# trigram of the text, including the ones with the start and end markers, points
+# to the texts containing it. A substring search intersects the lists of the
+# trigrams of the query and checks the few texts left. A fuzzy search counts the
+# trigrams shared with the query and computes the edit distance of the query to
+# the best matching part of the candidate texts. Results are grouped by the text
+# and field and only the best k groups are returned.
+#
+
+import heapq
+from array import array
+from collections import Counter
+
+from board_model import component_key
+
+FIELDS = ("component", "part", "type", "location", "trace")
+MAX_CANDIDATES = 5000
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def substring_distance(query, text, limit):
+    # the smallest number of edits (a swap of neighbor characters is one edit) turning the query into a part
+    # of the text, or limit + 1 when over the limit
+    before = None
+    previous = [0] * (len(text) + 1)
+    for i, qc in enumerate(query, 1):
+        current = [i]
+        for j, tc in enumerate(text, 1):
+            d = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (qc != tc))
+            if before is not None and j > 1 and qc == text[j - 2] and query[i - 2] == tc:
+                d = min(d, before[j - 2] + 1)
+            current.append(d)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous)
+
+
+class SearchResult:
+    __slots__ = ("distance", "field", "text", "ids")
+
+    def __init__(self, distance, field, text, ids):
+        self.distance = distance
+        self.field = field
+        self.text = text
+        # (board, ID) pairs, board is None for a single board
+        self.ids = ids
+
+
+class SearchIndex:
+    def __init__(self):
+        self.texts = []
+        self.text_index = {}
+        self.grams = {}
+        # entries of a text are linked from first_entry through next_entry, -1 ends the list
+        self.first_entry = array("i")
+        self.next_entry = array("i")
+        self.entry_field = array("b")
+        self.entry_board = array("i")
+        self.entry_id = []
+        self.boards = []
+
+    def __len__(self):
+        return len(self.entry_id)
+
+    def add(self, board, field, text, cid):
+        if text == "":
+            return
+        text = text.upper()
+        tid = self.text_index.get(text)
+        if tid is None:
+            tid = self.text_index[text] = len(self.texts)
+            self.texts.append(text)
+            self.first_entry.append(-1)
+            for gram in trigrams("\x02" + text + "\x03"):
+                postings = self.grams.get(gram)
+                if postings is None:
+                    postings = self.grams[gram] = array("i")
+                postings.append(tid)
+        self.next_entry.append(self.first_entry[tid])
+        self.first_entry[tid] = len(self.entry_id)
+        self.entry_field.append(field)
+        self.entry_board.append(board)
+        self.entry_id.append(cid)
+
+    def add_board(self, name, components, traces):
+        # components as (id, part, type, location) tuples, traces as their IDs
+        board = len(self.boards)
+        self.boards.append(name)
+        for cid, part, ctype, location in components:
+            self.add(board, 0, cid, cid)
+            self.add(board, 1, part, cid)
+            self.add(board, 2, ctype, cid)
+            self.add(board, 3, location, cid)
+        for tid in traces:
+            self.add(board, 4, tid, tid)
+
+    def substring_matches(self, query):
+        if len(query) < 3:
+            return [tid for tid, text in enumerate(self.texts) if query in text]
+        lists = []
+        for gram in trigrams(query):
+            if gram not in self.grams:
+                return []
+            lists.append(self.grams[gram])
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for postings in lists[1:]:
+            candidates.intersection_update(postings)
+            if len(candidates) == 0:
+                return []
+        return [tid for tid in candidates if query in self.texts[tid]]
+
+    def fuzzy_matches(self, query, limit, exclude):
+        # (distance, text ID) of texts within the limit of edits, sharing trigrams with the query
+        counts = Counter()
+        for gram in trigrams("\x02" + query + "\x03"):
+            if gram in self.grams:
+                counts.update(self.grams[gram])
+        # every edit changes at most 3 trigrams of the query
+        needed = max(1, len(query) - 2 - 3 * limit)
+        matches = []
+        for tid, n in counts.most_common(MAX_CANDIDATES):
+            if n < needed:
+                break
+            if tid not in exclude:
+                d = substring_distance(query, self.texts[tid], limit)
+                if d <= limit:
+                    matches.append((d, tid))
+        return matches
+
+    def search(self, query, k=20, fuzzy=True):
+        # the best k groups of entries with the same text and field: texts containing the query (exact ones first,
+        # then the ones starting with it), then texts differing from the query by the fewest edits
+        query = query.upper()
+        if query == "":
+            return []
+        scored = []
+        found = self.substring_matches(query)
+        for tid in found:
+            text = self.texts[tid]
+            scored.append((0, 0 if text == query else 1 if text.startswith(query) else 2, len(text), text, tid))
+        # fuzzy matches have at least one edit, they are not needed when k texts contain the query
+        if fuzzy and len(query) >= 3 and len(found) < k:
+            limit = min(3, len(query) // 3)
+            for d, tid in self.fuzzy_matches(query, limit, set(found)):
+                text = self.texts[tid]
+                scored.append((d, 3, abs(len(text) - len(query)), text, tid))
+        # a text has at most one group per field, so k texts are enough for k groups
+        results = []
+        for d, __, __, text, tid in heapq.nsmallest(k, scored):
+            groups = {}
+            e = self.first_entry[tid]
+            while e != -1:
+                board = self.boards[self.entry_board[e]]
+                groups.setdefault(self.entry_field[e], []).append((board, self.entry_id[e]))
+                e = self.next_entry[e]
+            for field in sorted(groups):
+                # U5 before U12, like the component lists
+                ids = sorted(groups[field], key=lambda i: (i[0] or "", component_key(i[1])))
+                results.append(SearchResult(d, FIELDS[field], text, ids))
+        return results[:k]
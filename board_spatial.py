@@ -0,0 +1,114 @@
+# Retro Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Spatial index of component boxes. Boxes are normalized (negative width and height
+# turned into positive ones) and registered in all cells of a uniform grid they cover.
+# The cell size is chosen so that a cell holds about one box on average, so a point
+# query checks only a few boxes and a region or nearest neighbor query only the cells
+# around the given place.
+#
+
+import math
+
+
+def normalize_box(box):
+    x, y, w, h = box
+    return min(x, x + w), min(y, y + h), max(x, x + w), max(y, y + h)
+
+
+def box_distance(b, x, y):
+    dx = max(b[0] - x, 0, x - b[2])
+    dy = max(b[1] - y, 0, y - b[3])
+    return math.hypot(dx, dy)
+
+
+class SpatialIndex:
+    def __init__(self, components):
+        self.ids = []
+        self.boxes = []
+        for cid, c in components.items():
+            if "box" in c:
+                self.ids.append(cid)
+                self.boxes.append(normalize_box(c["box"]))
+        self.cells = {}
+        if len(self.boxes) == 0:
+            self.origin = (0, 0)
+            self.cell = 1
+            self.span = 0
+            return
+        x0 = min([b[0] for b in self.boxes])
+        y0 = min([b[1] for b in self.boxes])
+        x1 = max([b[2] for b in self.boxes])
+        y1 = max([b[3] for b in self.boxes])
+        self.origin = (x0, y0)
+        self.cell = max(1.0, math.sqrt((x1 - x0) * (y1 - y0) / len(self.boxes)))
+        self.span = max(self.cell_of(x1, y1)) + 1
+        for idx, b in enumerate(self.boxes):
+            i0, j0 = self.cell_of(b[0], b[1])
+            i1, j1 = self.cell_of(b[2], b[3])
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    self.cells.setdefault((i, j), []).append(idx)
+
+    def cell_of(self, x, y):
+        return int((x - self.origin[0]) // self.cell), int((y - self.origin[1]) // self.cell)
+
+    def at(self, x, y):
+        # components whose boxes contain the point, the smallest (most specific) first
+        found = [idx for idx in self.cells.get(self.cell_of(x, y), ())
+                 if self.boxes[idx][0] <= x <= self.boxes[idx][2] and self.boxes[idx][1] <= y <= self.boxes[idx][3]]
+        area = lambda b: (b[2] - b[0]) * (b[3] - b[1])
+        found.sort(key=lambda idx: (area(self.boxes[idx]), self.ids[idx]))
+        return [self.ids[idx] for idx in found]
+
+    def region(self, x0, y0, x1, y1):
+        # components whose boxes overlap the rectangle
+        x0, y0, x1, y1 = normalize_box((x0, y0, x1 - x0, y1 - y0))
+        i0, j0 = self.cell_of(x0, y0)
+        i1, j1 = self.cell_of(x1, y1)
+        found = set()
+        for i in range(max(i0, 0), min(i1, self.span) + 1):
+            for j in range(max(j0, 0), min(j1, self.span) + 1):
+                found.update(self.cells.get((i, j), ()))
+        return [self.ids[idx] for idx in found
+                if self.boxes[idx][0] <= x1 and self.boxes[idx][2] >= x0 and
+                self.boxes[idx][1] <= y1 and self.boxes[idx][3] >= y0]
+
+    def nearest(self, x, y, k, exclude=()):
+        # k components with boxes closest to the point as (id, distance) pairs, the cells are scanned
+        # in growing rings until no box outside of the scanned square can be closer than the k-th one
+        if k < 1:
+            return []
+        ci, cj = self.cell_of(x, y)
+        seen = set()
+        best = []
+        for r in range(self.span + abs(ci) + abs(cj) + 1):
+            for i in range(ci - r, ci + r + 1):
+                for j in (range(cj - r, cj + r + 1) if i in (ci - r, ci + r) else (cj - r, cj + r)):
+                    for idx in self.cells.get((i, j), ()):
+                        if idx not in seen:
+                            seen.add(idx)
+                            if self.ids[idx] not in exclude:
+                                best.append((box_distance(self.boxes[idx], x, y), self.ids[idx]))
+            if len(best) >= k:
+                best.sort()
+                del best[k:]
+                if best[-1][0] <= r * self.cell:
+                    break
+        best.sort()
+        return [(cid, d) for d, cid in best[:k]]
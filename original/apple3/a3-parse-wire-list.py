@@ -27,7 +27,7 @@
 # Author: Pawel Pieczul
 #
 
-import sys, re, json, functools
+import sys, re, json
 from json import JSONEncoder
 
 class ObjectEncoder(JSONEncoder):
@@ -35,17 +35,84 @@ class ObjectEncoder(JSONEncoder):
 		return o.__dict__    
 
 class MotherBoard:
-	traces = {}
-	components = {}
-	noname_trace_idx = 1
-	board = {"components" : components, "traces" : traces}
-	def toJson(self):
-		return json.dumps(self.board, sort_keys=True, indent=4, cls=ObjectEncoder)
+	# state of a single parsed board, finished components are not kept here but passed on by parse_wire_list
+	def __init__(self):
+		self.traces = {}
+		self.noname_trace_idx = 1
+		# index of stored pins in original form ("ID-pin") to names of traces containing them,
+		# and the order in which the traces were stored
+		self.pin_traces = {}
+		self.trace_order = {}
+		# components already parsed and traces of short pins growing until the end of the wire list
+		self.finished = set()
+		self.growing = set()
+
+	def store_trace(self, name, trace):
+		for pin in trace_to_original_form(self.traces.get(name, [])):
+			self.unindex_pin(pin, name)
+		self.traces[name] = trace
+		self.trace_order.setdefault(name, len(self.trace_order))
+		for pin in trace_to_original_form(trace):
+			self.index_pin(pin, name)
+
+	def extend_trace(self, name, connection):
+		self.growing.add(name)
+		self.traces.setdefault(name, []).append(connection)
+		self.trace_order.setdefault(name, len(self.trace_order))
+		self.index_pin(connection[0] + "-" + str(connection[1] + 1), name)
+
+	# a pin is normally part of one trace only, so a set of names is created only when it is not
+	def index_pin(self, pin, name):
+		names = self.pin_traces.get(pin)
+		if names is None or names == name:
+			self.pin_traces[pin] = name
+		elif isinstance(names, str):
+			self.pin_traces[pin] = {names, name}
+		else:
+			names.add(name)
+
+	def unindex_pin(self, pin, name):
+		names = self.pin_traces.get(pin)
+		if names == name:
+			del self.pin_traces[pin]
+		elif isinstance(names, set):
+			names.discard(name)
+
+	def finish_component(self, comp):
+		# (name, pins) of the traces of the component whose components are all parsed now, they are removed
+		# from the board; pins of a validated component are the names of their traces
+		self.finished.add(comp.id)
+		done = []
+		for name in set(comp.pins):
+			if name in self.traces and name not in self.growing and \
+				all(t[0] in self.finished for t in self.traces[name]):
+				done.append((name, self.remove_trace(name)))
+		return done
+
+	def remove_trace(self, name):
+		trace = self.traces.pop(name)
+		del self.trace_order[name]
+		for pin in trace_to_original_form(trace):
+			self.unindex_pin(pin, name)
+		return trace
+
+	def pin_trace_names(self, pin):
+		names = self.pin_traces.get(pin, ())
+		return (names,) if isinstance(names, str) else names
+
+	def overlapping_trace(self, trace):
+		# first stored trace sharing pins with the given one and the number of shared pins
+		counts = {}
+		for connection in trace:
+			for tr in self.pin_trace_names(connection):
+				counts[tr] = counts.get(tr, 0) + 1
+		if len(counts) == 0:
+			return None, 0
+		tr = min(counts.keys(), key=lambda t: self.trace_order[t])
+		return tr, counts[tr]
 
 class Component:
 	def __init__(self, board, id, pages, part, pin_count, type="", location=""):
-		traces = board.traces
-		components = board.components
 		if len(type) > 0 and len(location) == 0:
 			location = type
 			type = ""
@@ -70,11 +137,9 @@ class Component:
 			raise ValueError("Wrong board location syntax ({})".format(location))
 		self.location = location
 		self.pins = {}
-		board.components[self.id] = self
 
 	def add_trace(self, board, pin, name, trace=[]):
 		traces = board.traces
-		components = board.components
 		if pin < 1 or pin > self.pin_count:
 			raise ValueError("Pin ({}) out of component range ({})".format(pin, comp.pin_count))
 		if len(trace) == 0:
@@ -93,36 +158,29 @@ class Component:
 				raise ValueError("Wrong connection in trace ({})".format(connection))
 		if len(set(trace)) != len(trace):
 			raise ValueError("Trace contains duplicate values")		
-		cnt = 0
-		for tr in traces.keys():
-			cnt = functools.reduce(lambda a, b: a + 1 if b in trace_to_original_form(traces[tr]) else a, trace, 0)
-			if cnt > 0:
-				if cnt != len(trace):
-					raise ValueError("Trace ({}:{}) different to already stored ({}:{})".format(name, trace, tr, traces[tr]))		
-				if name == "?":
-					name = tr;
-				elif name != tr:
-					raise ValueError("Trace ({}) named differently than already stored ({})".format(name, tr))		
-				elif self.id + "-" + str(pin) not in trace_to_original_form(traces[tr]):
-					raise ValueError("Source pin ({}) name not part of the trace list".format(pin))		
-				break
+		tr, cnt = board.overlapping_trace(trace)
+		if cnt > 0:
+			if cnt != len(trace):
+				raise ValueError("Trace ({}:{}) different to already stored ({}:{})".format(name, trace, tr, traces[tr]))		
+			if name == "?":
+				name = tr;
+			elif name != tr:
+				raise ValueError("Trace ({}) named differently than already stored ({})".format(name, tr))		
+			elif tr not in board.pin_trace_names(self.id + "-" + str(pin)):
+				raise ValueError("Source pin ({}) name not part of the trace list".format(pin))		
 		if cnt == 0:
 			if name == "?":
 				name = "T" + str(board.noname_trace_idx).zfill(3);
 				board.noname_trace_idx += 1
 			if name != "" and len(trace) == 0:
-				if name in traces.keys():
-					a = traces[name]
-				else:
-					a = []
-				traces[name] = a + [[self.id, pin - 1]]
+				board.extend_trace(name, [self.id, pin - 1])
 			else:
 				if name != "":
 					new_trace = []
 					for t in trace:
 						i = re.split("-", t)
-						new_trace.append([i[0], int(i[1]) - 1])
-					traces[name] = new_trace
+						new_trace.append([sys.intern(i[0]), int(i[1]) - 1])
+					board.store_trace(name, new_trace)
 		self.pins[pin] = name
 
 	def validate(self):
@@ -141,8 +199,13 @@ class Component:
 def trace_to_original_form(trace):
 	return [t[0] + "-" + str(t[1]+1) for t in trace] 
 
-def process_file(file, board):
-	header = True
+def parse_wire_list(file, error=print):
+	# generator yielding ("component", Component) as soon as a component block is finished and validated,
+	# and ("trace", name, pins) as soon as all components of a trace are (traces of short pins, like power
+	# ones, at the end); finished traces are dropped, so later lines are not checked against them; each call
+	# parses with its own board state
+	board = MotherBoard()
+	comp = None
 	line_number = 0
 	expected_pin = 0
 	for line in file:
@@ -151,8 +214,11 @@ def process_file(file, board):
 		line = line.rstrip().lstrip()
 		if re.match("^[A-Z].+", line):
 			# validate previous component
-			if 'comp' in locals():
+			if comp is not None:
 				comp.validate()
+				yield "component", comp
+				for name, trace in board.finish_component(comp):
+					yield "trace", name, trace
 			# header format is:
 			# <component-id> <schematic-pages> <component-value> <number-of-pins> [component-type] [board-location]
 			h = re.split("\s+", line)
@@ -160,55 +226,106 @@ def process_file(file, board):
 			expected_pin = 0
 			try:
 				if hl < 4:
-					print(line_number, ": Component header too short ({})".format(hl))
+					error(line_number, ": Component header too short ({})".format(hl))
 				elif hl > 6:
-					print(line_number, ": Component header too long ({})".format(hl))
+					error(line_number, ": Component header too long ({})".format(hl))
 				else:
 					comp = Component(board, *h)
 			except ValueError as e:
-				print(line_number, ":", e)
+				error(line_number, ":", e)
 		elif re.match("^[0-9]+\s+.+", line):
 			# pin definition line, format is:
 			# <pin-number> <trace-name> <component-id-1> [component-id-2] ...
 			h = re.split("\s+", line)
 			hl = len(h)
 			expected_pin += 1
-			if 'comp' not in locals():
-				print(line_number, ": Unexpected pin - no component")
+			if comp is None:
+				error(line_number, ": Unexpected pin - no component")
 			elif hl < 2:
-				print(line_number, ": Pin description too short ({})".format(hl))
+				error(line_number, ": Pin description too short ({})".format(hl))
 			elif not re.match("\d+", h[0]):
-				print(line_number, ": Wrong pin number syntax ({})".format(h[0]))
+				error(line_number, ": Wrong pin number syntax ({})".format(h[0]))
 			else:
 				pin = int(h[0])
 				if pin != expected_pin:
-					print(line_number, ": Pin ({}) but expected pin ({})".format(pin, expected_pin))
+					error(line_number, ": Pin ({}) but expected pin ({})".format(pin, expected_pin))
 				else:
 					try:							
 						comp.add_trace(board, pin, h[1], h[2:])
 					except ValueError as e:
-						print(line_number, ":", e)
+						error(line_number, ":", e)
 		else:
-			print(line_number, ": Ambiguous line ({})".format(line))
+			error(line_number, ": Ambiguous line ({})".format(line))
 			expected_pin = 0
-	comp.validate()
+	if comp is not None:
+		comp.validate()
+		yield "component", comp
+	# the rest: power traces and traces of components missing in the wire list
+	for name, trace in board.traces.items():
+		yield "trace", name, trace
+
+def parse_board(file, error=print):
+	# complete board dictionary in the syntax of the board JSON files
+	components = {}
+	traces = {}
+	for item in parse_wire_list(file, error):
+		if item[0] == "component":
+			components[item[1].id] = item[1].__dict__
+		else:
+			traces[item[1]] = item[2]
+	return {"components" : components, "traces" : traces}
 
-def read_file(fname):
+def write_jsonl(items, out):
+	for item in items:
+		if item[0] == "component":
+			out.write(json.dumps({"component" : item[1].__dict__}, sort_keys=True) + "\n")
+		else:
+			out.write(json.dumps({"trace" : {"id" : item[1], "pins" : item[2]}}) + "\n")
+
+def write_json_stream(items, out):
+	# one JSON document in the syntax of the board JSON files, written record by record; traces finished
+	# between components are kept in a temporary file until all components are written
+	import tempfile
+	with tempfile.TemporaryFile("w+") as traces:
+		out.write("{\n\"components\": {")
+		separator = "\n"
+		for item in items:
+			if item[0] == "component":
+				out.write(separator + json.dumps(item[1].id) + ": " + json.dumps(item[1].__dict__, sort_keys=True))
+				separator = ",\n"
+			else:
+				traces.write(("\n" if traces.tell() == 0 else ",\n") + json.dumps(item[1]) + ": " +
+					json.dumps(item[2]))
+		out.write("\n},\n\"traces\": {")
+		traces.seek(0)
+		for chunk in iter(lambda: traces.read(1 << 16), ""):
+			out.write(chunk)
+		out.write("\n}}\n")
+
+def print_error(*args):
+	print(*args, file=sys.stderr)
+
+def read_file(fname, output=None):
 	try:
 		file = open(fname, "r")
 	except IOError:
 		print("\nCan't open file:", fname, "\n")
 		return -1
-	board = MotherBoard()
-	process_file(file, board)
+	if output == "--jsonl":
+		write_jsonl(parse_wire_list(file, print_error), sys.stdout)
+	elif output == "--stream":
+		write_json_stream(parse_wire_list(file, print_error), sys.stdout)
+	else:
+		print(json.dumps(parse_board(file), sort_keys=True, indent=4, cls=ObjectEncoder))
 	file.close()
-	print(board.toJson())
 
 def main(argv):
-	if len(argv) < 2:
-		print("\nUsage:", argv[0], "<netlist-file>\n")
+	args = [a for a in argv[1:] if a not in ("--jsonl", "--stream")]
+	output = ([a for a in argv[1:] if a in ("--jsonl", "--stream")] + [None])[0]
+	if len(args) < 1:
+		print("\nUsage:", argv[0], "[--jsonl|--stream] <netlist-file>\n")
 		return -1
-	return read_file(argv[1])
+	return read_file(args[0], output)
 
 if __name__ == "__main__":
 	assert sys.version_info >= (3, 0)
@@ -0,0 +1,243 @@
+#!/opt/local/bin/python3.7
+
+# Apple /// Board Schematic Tools
+# Copyright (C) 2019 oldcrap.org
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# This script builds the board JSON files in the data directory from all board
+# directories found here. A board directory should contain:
+# <prefix>-parse-wire-list.py       - the wire list parser for the board
+# <prefix>-wire-list.txt            - the wire list
+# <prefix>-component-locations.csv  - optional component locations
+# and the result is written to ../data/<prefix>-board.json. Boards are built in
+# parallel, the locations are merged in memory in the same way as add-locations.py
+# does it and top level values other than components and traces (like the board
+# image) are kept from the existing JSON file. Content hashes of the sources and
+# of the written JSON file are kept in ../data/.build-boards.json: boards with
+# unchanged sources and JSON files are skipped, and a JSON file that differs both
+# from the last build and from what its sources produce (edited by hand) is not
+# overwritten unless --force is given.
+#
+
+import sys, os, re, io, json, getopt, contextlib, hashlib, importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from json import JSONEncoder
+
+ORIGINAL_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(ORIGINAL_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+STATE_FILE = os.path.join(DATA_DIR, ".build-boards.json")
+
+class ObjectEncoder(JSONEncoder):
+	def default(self, o):
+		return o.__dict__
+
+class BoardSources:
+	def __init__(self, directory, prefix):
+		self.name = os.path.basename(directory)
+		self.parser = os.path.join(directory, prefix + "-parse-wire-list.py")
+		self.wire_list = os.path.join(directory, prefix + "-wire-list.txt")
+		self.locations = os.path.join(directory, prefix + "-component-locations.csv")
+		if not os.path.exists(self.locations):
+			self.locations = None
+		self.json_file = os.path.join(DATA_DIR, prefix + "-board.json")
+
+	def files(self):
+		return [f for f in (self.parser, self.wire_list, self.locations, os.path.join(ORIGINAL_DIR, "add-locations.py")) if f is not None]
+
+	def sources_hash(self):
+		h = hashlib.sha1()
+		for f in self.files():
+			h.update(os.path.basename(f).encode("utf-8") + b"\0")
+			with open(f, "rb") as file:
+				h.update(file.read())
+		return h.hexdigest()
+
+	def is_up_to_date(self, built, cache):
+		# built is the state of the last build, file times are not used as git does not keep them
+		if built is None or not os.path.exists(self.json_file):
+			return False
+		if built["sources"] != self.sources_hash() or built["output"] != file_hash(self.json_file):
+			return False
+		if cache:
+			import board_cache
+			try:
+				header = board_cache.read_header(board_cache.cache_name(self.json_file))
+				return header is not None and board_cache.is_valid(header, self.json_file,
+					board_cache.image_name(header["extra"]))
+			except (IOError, ValueError, KeyError):
+				return False
+		return True
+
+def file_hash(fname):
+	with open(fname, "rb") as file:
+		return hashlib.sha1(file.read()).hexdigest()
+
+def read_state():
+	try:
+		with open(STATE_FILE, "r") as file:
+			return json.load(file)
+	except (IOError, ValueError):
+		return {}
+
+def write_state(state):
+	tmp = STATE_FILE + ".tmp" + str(os.getpid())
+	with open(tmp, "w") as file:
+		file.write(json.dumps(state, sort_keys=True, indent=4) + "\n")
+	os.replace(tmp, STATE_FILE)
+
+def find_boards(names):
+	boards = []
+	for d in sorted(os.listdir(ORIGINAL_DIR)):
+		directory = os.path.join(ORIGINAL_DIR, d)
+		if not os.path.isdir(directory) or (names and d not in names):
+			continue
+		for f in sorted(os.listdir(directory)):
+			m = re.match(r"(.+)-parse-wire-list\.py$", f)
+			if m and os.path.exists(os.path.join(directory, m.group(1) + "-wire-list.txt")):
+				boards.append(BoardSources(directory, m.group(1)))
+	return boards
+
+def load_script(fname):
+	name = re.sub(r"\W", "_", os.path.splitext(os.path.basename(fname))[0])
+	spec = importlib.util.spec_from_file_location(name, fname)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+def read_existing(json_file):
+	try:
+		with open(json_file, "r") as file:
+			data = json.load(file)
+	except (IOError, ValueError):
+		return {}
+	return {k: v for k, v in data.items() if k not in ("components", "traces")}
+
+def write_json(json_file, text):
+	tmp = json_file + ".tmp" + str(os.getpid())
+	with open(tmp, "w") as file:
+		file.write(text)
+	os.replace(tmp, json_file)
+
+def is_edited(json_file, built_output, text):
+	# the existing file is neither the output of the last build nor equal to the new one
+	if not os.path.exists(json_file) or file_hash(json_file) == built_output:
+		return False
+	try:
+		with open(json_file, "r") as file:
+			return json.load(file) != json.loads(text)
+	except ValueError:
+		return True
+
+def build_board(board, cache, force, built_output):
+	# runs in a worker process, returns (board name, list of messages, success, hash of the written JSON file)
+	messages = []
+	error = lambda *args: messages.append(" ".join([str(a) for a in args]))
+	try:
+		with open(board.wire_list, "r") as file:
+			try:
+				data = load_script(board.parser).parse_board(file, error)
+			except ValueError as e:
+				error(e)
+		if messages:
+			return board.name, messages, False, None
+		if board.locations is not None:
+			out = io.StringIO()
+			try:
+				with open(board.locations, "r") as file, contextlib.redirect_stdout(out):
+					load_script(os.path.join(ORIGINAL_DIR, "add-locations.py")).process_csv(file, data)
+			except (SystemExit, KeyError) as e:
+				messages += out.getvalue().splitlines() or ["Unknown component {}".format(e)]
+				return board.name, messages, False, None
+		data.update(read_existing(board.json_file))
+		text = json.dumps(data, sort_keys=True, indent=4, cls=ObjectEncoder) + "\n"
+		if not force and is_edited(board.json_file, built_output, text):
+			messages.append("{} differs from its sources and the last build (edited by hand?), use --force to "
+				"overwrite it".format(os.path.relpath(board.json_file, ROOT_DIR)))
+			return board.name, messages, False, None
+		write_json(board.json_file, text)
+		messages.append("{} components, {} traces -> {}".format(len(data["components"]), len(data["traces"]),
+			os.path.relpath(board.json_file, ROOT_DIR)))
+		if cache:
+			import board_cache
+			from board import load_image
+			image = load_image(data["board_image"], True) if "board_image" in data else None
+			if board_cache.save(board.json_file, data, image):
+				messages.append("compiled cache -> " + os.path.relpath(board_cache.cache_name(board.json_file), ROOT_DIR))
+	except IOError as e:
+		messages.append("Can't open file: {}".format(e.filename))
+		return board.name, messages, False, None
+	return board.name, messages, True, file_hash(board.json_file)
+
+def usage(name):
+	print("\nUsage:", name, "[--force] [--cache] [--jobs <n>] [<board-directory> ...]\n")
+
+def main(argv):
+	try:
+		opts, args = getopt.getopt(argv[1:], "fj:", ["force", "cache", "jobs="])
+	except getopt.GetoptError:
+		usage(argv[0])
+		return -1
+	force = False
+	cache = False
+	jobs = os.cpu_count() or 1
+	for o, a in opts:
+		if o in ("-f", "--force"):
+			force = True
+		elif o == "--cache":
+			cache = True
+		elif o in ("-j", "--jobs"):
+			if not a.isdigit() or int(a) < 1:
+				usage(argv[0])
+				return -1
+			jobs = int(a)
+	# board images are loaded from ./pictures and board_cache is in the main directory
+	os.chdir(ROOT_DIR)
+	sys.path.insert(0, ROOT_DIR)
+	boards = find_boards(args)
+	if not boards:
+		print("\nNo boards found\n")
+		return -1
+	cache_of = lambda b: cache or os.path.exists(os.path.splitext(b.json_file)[0] + ".board.bin")
+	state = read_state()
+	built_of = lambda b: state.get(os.path.basename(b.json_file))
+	todo = []
+	for b in boards:
+		if not force and b.is_up_to_date(built_of(b), cache_of(b)):
+			print("{}: up to date".format(b.name))
+		else:
+			todo.append(b)
+	failed = 0
+	if todo:
+		# sources are hashed before the build, a change made during the build is found next time
+		sources = {b.name: b.sources_hash() for b in todo}
+		with ProcessPoolExecutor(max_workers=min(jobs, len(todo))) as executor:
+			futures = [executor.submit(build_board, b, cache_of(b), force, (built_of(b) or {}).get("output"))
+				for b in todo]
+			for b, f in zip(todo, futures):
+				name, messages, success, output = f.result()
+				for m in messages:
+					print("{}: {}".format(name, m))
+				if success:
+					state[os.path.basename(b.json_file)] = {"sources": sources[b.name], "output": output}
+				else:
+					failed += 1
+		write_state(state)
+	return -1 if failed else 0
+
+if __name__ == "__main__":
+	assert sys.version_info >= (3, 0)
+	sys.exit(main(sys.argv[0:]))